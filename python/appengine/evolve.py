@@ -1,114 +1,180 @@
-import bisect
-import collections
 import logging
-import math
-import random
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
 
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 from google.appengine.ext.deferred import defer
 from google.appengine.ext import ndb
+import numpy
 
 import ga
 import model
+import ranking
 
 ERROR_THRESHOLD = 0.01
 DAMPING_FACTOR = 0.85
+# Processes to render new individuals with. App Engine can't start
+# processes, so raise this only when running somewhere else.
+RENDER_WORKERS = 1
 
-def pagerank(scores, edges):
-    new_scores = dict((k, 0.0) for k in scores.keys())
-    residual_score = (1 - DAMPING_FACTOR)
-    for owner, score in scores.iteritems():
-        score *= DAMPING_FACTOR
-        links = edges[owner]
-        if not links:
-            # Sink
-            residual_score += score
-        else:
-            total_weight = float(sum(x[1] for x in links))
-            for target, weight in links:
-                new_scores[target] += (weight / total_weight) * score
-    residual_score /= len(new_scores)
-    for owner in new_scores:
-        new_scores[owner] += residual_score
+def total_by_index(indices, weights, size):
+    """Sums `weights` for each index from 0 to size - 1."""
+    if not len(indices):
+        # Older versions of numpy.bincount refuse empty arrays.
+        return numpy.zeros(size)
+    return numpy.bincount(indices, weights, minlength=size)
+
+class VoteGraph(object):
+    """Votes between individuals numbered 0 to size - 1, as a sparse matrix.
+
+    Each vote is an edge from the loser to the winner, weighted by how many
+    times it was cast, and divided by the total weight leaving the loser so
+    that each individual passes on all of its score.
+    """
+    def __init__(self, size, losers, winners, counts):
+        self.size = size
+        self.losers = numpy.asarray(losers, dtype=int)
+        self.winners = numpy.asarray(winners, dtype=int)
+        counts = numpy.asarray(counts, dtype=float)
+        out_weights = total_by_index(self.losers, counts, size)
+        self.weights = counts / out_weights[self.losers]
+        self.sinks = out_weights == 0
+
+def pagerank(scores, graph):
+    """Does one step of power iteration, returning the new array of scores."""
+    flow = scores[graph.losers] * graph.weights
+    new_scores = DAMPING_FACTOR * total_by_index(graph.winners, flow, graph.size)
+    residual_score = (1 - DAMPING_FACTOR) + DAMPING_FACTOR * scores[graph.sinks].sum()
+    new_scores += residual_score / graph.size
     return new_scores
 
 def rms_error(a, b):
-    total_error = 0.0
-    count = 0
-    for k in a:
-        count += 1
-        total_error += (b[k] - a[k]) ** 2
-    return math.sqrt(total_error) / count
+    return numpy.sqrt(((b - a) ** 2).sum()) / len(a)
 
 def score_generation(generation_id):
-    """Scores and ranks a generation of individuals."""
+    """Scores and ranks a generation of individuals.
+
+    Iteration starts from the individuals' existing scores, if they have any.
+    """
     individuals = model.Individual.query(model.Individual.generation == generation_id).fetch()
-    individuals = dict((x.key, x) for x in individuals)
+    index = dict((x.key, i) for i, x in enumerate(individuals))
     start_score = 1.0 / len(individuals)
-    scores = dict((i.key, i.score or start_score) for i in individuals.values())
+    scores = numpy.array([x.score or start_score for x in individuals])
 
     votes = model.Vote.query(model.Vote.generation == generation_id).fetch()
-    edges = collections.defaultdict(list)
-    for vote in votes:
-        edges[vote.loser].append((vote.winner, vote.count))
+    votes = [v for v in votes if v.loser in index and v.winner in index]
+    graph = VoteGraph(len(individuals),
+                      [index[v.loser] for v in votes],
+                      [index[v.winner] for v in votes],
+                      [v.count for v in votes])
 
-    new_scores = pagerank(scores, edges)
+    new_scores = pagerank(scores, graph)
     steps = 1
     while rms_error(scores, new_scores) > ERROR_THRESHOLD:
         scores = new_scores
-        new_scores = pagerank(scores, edges)
+        new_scores = pagerank(scores, graph)
         steps += 1
     logging.info("Scores stabilized after %d steps", steps)
-    score_rank = sorted(new_scores.items(), key=lambda (k, v): v, reverse=True)
-    for rank, (key, score) in enumerate(score_rank):
-        individuals[key].rank = rank
-        individuals[key].score = score
-    ndb.put_multi(individuals.values())
-    return individuals.values()
-
-class WeightedRandomGenerator(object):
-    def __init__(self, weights):
-        self.totals = []
-        running_total = 0
-        
-        for w in weights:
-            running_total += w
-            self.totals.append(running_total)
-    
-    def next(self):
-        rnd = random.random() * self.totals[-1]
-        return bisect.bisect_right(self.totals, rnd)
+    for rank, i in enumerate(numpy.argsort(-new_scores, kind='mergesort')):
+        individuals[i].rank = rank
+        individuals[i].score = float(new_scores[i])
+    ndb.put_multi(individuals)
+    return individuals
 
+def rank_generation(generation_id):
+    """Scores and ranks a generation from the live ratings of its individuals."""
+    individuals = model.Individual.query(model.Individual.generation == generation_id).fetch()
+    ratings = ranking.checkpoint(generation_id)
+    scores = ranking.strengths(ratings)
+    by_rating = sorted(individuals, key=lambda x: ratings[x.key.id()], reverse=True)
+    for rank, individual in enumerate(by_rating):
+        individual.rank = rank
+        individual.score = scores[individual.key.id()]
+    ndb.put_multi(individuals)
+    return individuals
+
+def breed(individuals, weights, num_children):
+    """Crossbreeds individuals as `ga.breed` does, giving parents as keys.
+
+    Returns a list of (genome, parents) tuples for `ga.screen`.
+    """
+    genomes = [individual.genome for individual in individuals]
+    return [(genome, [individuals[i1].key, individuals[i2].key])
+            for genome, (i1, i2) in ga.breed(genomes, weights, num_children)]
+
+def render_children(children, workers):
+    """Looks up the images for screened children, rendering those that
+    haven't been drawn before.
+
+    Returns a dict mapping each fingerprint to a (rendering, pngs) tuple:
+    the Rendering in `model.render_cache` and None if there is one,
+    otherwise None and the result of `model.render_pngs`.
+    """
+    results = {}
+    genomes = {}
+    for genome, parents, fingerprint in children:
+        rendering = model.render_cache.get(fingerprint)
+        if rendering:
+            results[fingerprint] = (rendering, None)
+        else:
+            genomes[fingerprint] = genome
+    fingerprints = sorted(genomes)
+    genomes = [genomes[fingerprint] for fingerprint in fingerprints]
+    if workers > 1 and multiprocessing and len(genomes) > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            pngs = pool.map(model.render_pngs, genomes)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        pngs = map(model.render_pngs, genomes)
+    results.update((fingerprint, (None, data)) for fingerprint, data in zip(fingerprints, pngs))
+    return results
 
-def new_generation(next_generation_id, num_individuals, individuals=None):
+def new_generation(next_generation_id, num_individuals, individuals=None, workers=RENDER_WORKERS):
     if not individuals:
         individuals = model.Individual.query(model.Individual.generation == next_generation_id - 1).fetch()
-    weights = WeightedRandomGenerator(i.score for i in individuals)
+    weights = ga.WeightedRandomGenerator(i.score for i in individuals)
 
     nextgen = []
+    renderings = []
+    seen = set()
     while len(nextgen) < num_individuals:
-        i1 = individuals[weights.next()]
-        i2 = individuals[weights.next()]
-        for genome in ga.crossbreed(i1.genome, i2.genome):
+        children = breed(individuals, weights, num_individuals - len(nextgen))
+        children = ga.screen(children, seen)
+        rendered = render_children(children, workers)
+        for genome, parents, fingerprint in children:
+            rendering, pngs = rendered[fingerprint]
             child = model.Individual.create(
                 genome=genome,
                 generation=next_generation_id,
-                parents=[i1.key, i2.key])
+                parents=parents,
+                pngs=pngs,
+                fingerprint=fingerprint,
+                rendering=rendering,
+                renderings=renderings)
             if child:
                 nextgen.append(child)
         logging.info("Generated %d individuals", len(nextgen))
+    logging.info("Render cache: %r", model.render_cache.stats())
     
     generation = model.Generation(id=next_generation_id, number=next_generation_id, num_individuals=len(nextgen))
     nextgen.append(generation)
-    ndb.put_multi(nextgen)
+    ndb.put_multi(nextgen + renderings)
     memcache.set('current_generation', next_generation_id)
     memcache.set('votes', 0)
 
 
 def next_generation():
     last_generation = model.Generation.query().order(-model.Generation.number).get()
-    individuals = score_generation(last_generation.number)
+    if ranking.has_ratings(last_generation.number):
+        individuals = rank_generation(last_generation.number)
+    else:
+        individuals = score_generation(last_generation.number)
     new_generation(last_generation.number + 1, 100, individuals=individuals)
 
 def check_vote_count():
@@ -1,4 +1,5 @@
-import inspect
+import bisect
+import logging
 import random
 
 import piclang
@@ -6,6 +7,72 @@ import piclang
 ATOM_MUTATION_RATE = 1.0 # Atom mutations per organism
 OP_MUTATION_RATE = 0.5 # Operator mutations per organism
 CHANGE_TYPE_PROBABILITY = 0.1 # Chance an atom will change type
+# Children whose pruned genomes are longer than this, or whose curves are
+# nested deeper, are dropped before they are rendered.
+MAX_GENOME_LENGTH = 100
+MAX_DEPTH = 30
+# Samples taken to check that a child's curve has some width and height.
+# They come from piclang.sample_grid, so that curves repeated a multiple of
+# this many times aren't taken to be a single point.
+SCREEN_POINTS = piclang.ADAPTIVE_MIN_POINTS
+
+class WeightedRandomGenerator(object):
+    def __init__(self, weights):
+        self.totals = []
+        running_total = 0
+        
+        for w in weights:
+            running_total += w
+            self.totals.append(running_total)
+    
+    def next(self):
+        rnd = random.random() * self.totals[-1]
+        return bisect.bisect_right(self.totals, rnd)
+
+def breed(genomes, weights, num_children):
+    """Crossbreeds genomes until there are `num_children` that draw curves.
+
+    Parents are picked by `weights`, a WeightedRandomGenerator over the
+    genomes. Returns a list of (genome, (index1, index2)) tuples, where the
+    indices are the parents' positions in `genomes`. Genomes are pruned,
+    and those that are only an atom are dropped; `screen` checks the rest.
+    """
+    children = []
+    while len(children) < num_children:
+        i1 = weights.next()
+        i2 = weights.next()
+        for genome in crossbreed(genomes[i1], genomes[i2]):
+            genome = piclang.prune(genome)
+            if genome and not piclang.is_atom(genome[-1]):
+                children.append((genome, (i1, i2)))
+    return children
+
+def screen(children, seen):
+    """Drops the children that aren't worth rendering.
+
+    Those are children whose genomes are too long or curves too deep, whose
+    curves are flat when sampled at SCREEN_POINTS points, and those that
+    draw the same curve as one whose fingerprint is in `seen`. The others'
+    fingerprints are added to `seen`. Returns a list of (genome, parents,
+    fingerprint) tuples.
+    """
+    kept = []
+    for genome, parents in children:
+        if len(genome) > MAX_GENOME_LENGTH or piclang.depth(genome) > MAX_DEPTH:
+            continue
+        curve = piclang.stackparse(genome)
+        fingerprint = piclang.fingerprint(curve)
+        if fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+        xs, ys = piclang.evaluate_array(curve, piclang.sample_grid(SCREEN_POINTS))
+        # The same test as normalize_array, which stops render drawing
+        # curves without any width or height, but false for NaNs too.
+        if not (xs.ptp() > 0 and ys.ptp() > 0):
+            continue
+        kept.append((genome, parents, fingerprint))
+    logging.info("Kept %d of %d children after screening", len(kept), len(children))
+    return kept
 
 def crossbreed(g1, g2):
     """Crossbreeds two genomes and returns any viable children."""
@@ -18,39 +85,41 @@ def cut_and_splice(g1, g2):
     return g1[:p1] + g2[p2:], g2[:p2] + g1[p1:]
 
 def mutate(genome):
+    """Mutates a piclang.Genome in place, and returns it."""
     atom_probability = ATOM_MUTATION_RATE / len(genome)
     op_probability = OP_MUTATION_RATE / len(genome)
-    for i in range(len(genome)):
-        if piclang.is_atom(genome[i]):
+    opcodes = genome.opcodes
+    start = 0 # Index in genome.constants of the numbers for opcode i
+    for i in range(len(opcodes)):
+        if opcodes[i] < piclang.FIRST_OPERATOR:
             if random.random() < atom_probability:
-                genome[i] = mutate_atom(genome[i])
+                mutate_atom(genome, i, start)
         else:
             if random.random() < op_probability:
-                genome[i] = mutate_op(genome[i])
+                opcodes[i] = mutate_op(opcodes[i])
+        start += piclang.OPCODE_CONSTANTS[opcodes[i]]
     return genome
 
-def mutate_atom(instruction):
+def mutate_atom(genome, i, start):
+    """Mutates the atom at i, whose numbers start at `start` in the constants."""
+    opcode = genome.opcodes[i]
     if random.random() < CHANGE_TYPE_PROBABILITY:
-        return random_atom(instruction)
-    if isinstance(instruction, (int, float)):
-        return mutate_number(instruction)
-    if isinstance(instruction, tuple):
-        if random.random < 0.5:
-            return (instruction[0], mutate_number(instruction[1]))
-        else:
-            return (mutate_number(instruction[0]), instruction[1])
-    atom_curves = (piclang.PlatonicCircle, piclang.PlatonicLine)
-    if isinstance(instruction, atom_curves):
-        return random.choice(atom_curves)()
-    return instruction
+        random_atom(genome, i, start)
+    elif opcode in (piclang.INTEGER, piclang.NUMBER):
+        genome.opcodes[i] = piclang.NUMBER
+        genome.constants[start] = mutate_number(genome.constants[start])
+    elif opcode == piclang.PAIR:
+        if random.random() < 0.5:
+            start += 1
+        genome.constants[start] = mutate_number(genome.constants[start])
+    else:
+        genome.opcodes[i] = random.choice((piclang.CIRCLE, piclang.LINE))
 
-def random_atom(old_atom=None):
-    typ = random.choice([float, tuple, piclang.PlatonicCircle, piclang.PlatonicLine])
-    if typ == float:
-        return random.random()
-    if typ == tuple:
-        return (random.random(), random.random())
-    return typ()
+def random_atom(genome, i, start=None):
+    """Replaces the atom at i with a random one."""
+    opcode = random.choice([piclang.NUMBER, piclang.PAIR, piclang.CIRCLE, piclang.LINE])
+    values = [random.random() for k in range(piclang.OPCODE_CONSTANTS[opcode])]
+    genome.set_atom(i, opcode, values, start)
 
 def mutate_number(num):
     if random.random() < 0.5:
@@ -60,6 +129,7 @@ def mutate_number(num):
         # Bigger
         return num * (1 + random.random())
 
-def mutate_op(instruction):
-    ops = [piclang.translate, piclang.scale, piclang.rotate, piclang.reverse, piclang.concat, piclang.repeat, piclang.step]
-    return random.choice(ops)
+MUTATION_OPS = [piclang.translate, piclang.scale, piclang.rotate, piclang.reverse, piclang.concat, piclang.repeat, piclang.step]
+
+def mutate_op(opcode):
+    return piclang.OPCODES[random.choice(MUTATION_OPS)]
@@ -1,5 +1,3 @@
-import evolve
-import model
 from piclang import *
 
 gen0_genomes = [
@@ -22,6 +20,9 @@ gen0_genomes = [
 ]
 
 def init():
+    # Imported here so that the genomes can be used away from App Engine.
+    import evolve
+    import model
     for genome in gen0_genomes:
         model.Individual.create(genome=genome, generation=0, parents=[]).put()
     model.Generation(number=0, num_individuals=len(gen0_genomes)).put()
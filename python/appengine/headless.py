@@ -0,0 +1,322 @@
+#! /usr/bin/env python
+"""Evolves curves offline, scored by a fitness function instead of votes.
+
+Breeds and screens children as evolve.py does, but without App Engine:
+each child is scored by a function of its curve, in a pool of worker
+processes, and parents are picked in proportion to their scores. The
+population is saved to a checkpoint file after every generation, so a run
+can be stopped and picked up again, and the best genomes can then be put
+in front of voters.
+
+Usage: headless.py fitness[,fitness...] generations [checkpoint [size [workers]]]
+where each fitness is one of the names in FITNESS_FUNCTIONS; several are
+multiplied together.
+"""
+
+import logging
+import os
+import pickle
+import sys
+import time
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+import ga
+import piclang
+
+# Size of the images that fitness functions look at, which matches the
+# thumbnails voters see, and the pen and gap scaled down to match it.
+FITNESS_IMAGE_SIZE = 128
+FITNESS_PEN_WIDTH = 1
+# Most points sampled from a curve to score it.
+FITNESS_POINTS = 8192
+# Pixels across the square blocks image_entropy measures ink in.
+ENTROPY_BLOCK = 8
+# Radius in steps and step interval the plotter draws curves at, as in
+# curveplotter.py.
+PLOT_RADIUS = 5000
+PLOT_SPEED = 2000
+# Predicted minutes at which plot_time scores a curve at a half, and after
+# which it stops adding up the time, as the score barely changes.
+PLOT_MINUTES = 10.0
+MAX_PLOT_MINUTES = 100.0
+DEFAULT_SIZE = 100
+# Most rounds of breeding step tries before it gives up on every child
+# scoring above 0.
+MAX_BREED_ATTEMPTS = 20
+
+
+def _ink(curve):
+    """Renders a curve, returning an array of how much each pixel is inked
+    from 0 to 1, or None if it can't be drawn."""
+    image = piclang.render(curve, FITNESS_POINTS, FITNESS_IMAGE_SIZE, penwidth=FITNESS_PEN_WIDTH,
+                           gapwidth=FITNESS_PEN_WIDTH, tolerance=0.5)
+    if image is None:
+        return None
+    return piclang.numpy.asarray(image.convert("L"), dtype=float) / 255
+
+
+def image_entropy(curve):
+    """Scores a curve by the entropy in bits of how much ink there is in
+    each ENTROPY_BLOCK pixel square of its picture. Pictures with both
+    bare and densely drawn areas, and shades between, score highest."""
+    ink = _ink(curve)
+    if ink is None:
+        return 0.0
+    count = FITNESS_IMAGE_SIZE // ENTROPY_BLOCK
+    ink = ink[:count * ENTROPY_BLOCK, :count * ENTROPY_BLOCK]
+    blocks = ink.reshape(count, ENTROPY_BLOCK, count, ENTROPY_BLOCK).sum(axis=(1, 3))
+    histogram = piclang.numpy.bincount(piclang.numpy.round(blocks).astype(int).ravel())
+    p = histogram[histogram > 0] / float(blocks.size)
+    return float(-(p * piclang.numpy.log2(p)).sum())
+
+
+def coverage(curve):
+    """Scores a curve by the fraction of its picture that is inked."""
+    ink = _ink(curve)
+    if ink is None:
+        return 0.0
+    return float(ink.mean())
+
+
+def path_length(curve):
+    """Scores a curve by how long it is, in widths of its picture."""
+    segments = piclang.interpolate_segments(curve, FITNESS_POINTS, 0.5 / FITNESS_IMAGE_SIZE)
+    numpy = piclang.numpy
+    scaled = piclang.normalize_array(numpy.concatenate([xs for xs, ys in segments]),
+                                     numpy.concatenate([ys for xs, ys in segments]), 1, 1)
+    if scaled is None:
+        return 0.0
+    breaks = numpy.cumsum([len(xs) for xs, ys in segments])[:-1]
+    total = 0.0
+    for xs, ys in zip(*[numpy.split(a, breaks) for a in scaled]):
+        total += numpy.hypot(numpy.diff(xs), numpy.diff(ys)).sum()
+    return float(total)
+
+
+def plot_time(curve):
+    """Scores a curve by how quickly the plotter would draw it: 1 for no
+    time at all, falling to a half at PLOT_MINUTES and on towards 0."""
+    # The plotter's modules live in the directory above, and aren't
+    # deployed with the app.
+    directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if directory not in sys.path:
+        sys.path.append(directory)
+    import estimate
+    import paths
+    model = estimate.MotionModel(PLOT_SPEED)
+    tolerance = paths.plotter_tolerance(estimate.STEPS_PER_CIRCLE, estimate.MAX_RADIUS)
+
+    def segments():
+        for xs, ys in piclang.interpolate_segments(curve * PLOT_RADIUS, FITNESS_POINTS, 1.0):
+            if model.elapsed > MAX_PLOT_MINUTES * 60:
+                return
+            yield paths.simplify(paths.iter_cut([(xs, ys)], PLOT_RADIUS), tolerance)
+    seconds, times = estimate.plot_time(segments(), PLOT_SPEED, model=model)
+    return 1 / (1 + seconds / 60 / PLOT_MINUTES)
+
+
+FITNESS_FUNCTIONS = {
+    'entropy': image_entropy,
+    'coverage': coverage,
+    'length': path_length,
+    'plot_time': plot_time,
+}
+
+
+class Product(object):
+    """A fitness function that multiplies the scores of several others.
+
+    Unlike a lambda, it can be sent to worker processes, as long as the
+    functions it multiplies are defined at the top level of a module.
+    """
+
+    def __init__(self, functions):
+        self.functions = list(functions)
+
+    def __call__(self, curve):
+        result = 1.0
+        for function in self.functions:
+            result *= function(curve)
+            if not result:
+                break
+        return result
+
+
+def fitness_named(names):
+    """Returns the fitness function for a comma separated list of names
+    from FITNESS_FUNCTIONS."""
+    functions = [FITNESS_FUNCTIONS[name] for name in names.split(",")]
+    if len(functions) == 1:
+        return functions[0]
+    return Product(functions)
+
+
+def evaluate(args):
+    """Returns the score `fitness` gives a genome's curve, or 0 if it can't
+    be scored. Takes a (fitness, genome) tuple, so that it can be used with
+    Pool.map."""
+    fitness, genome = args
+    try:
+        score = fitness(piclang.stackparse(genome))
+    except (ArithmeticError, ValueError, MemoryError):
+        logging.debug("Couldn't score %r", genome, exc_info=True)
+        return 0.0
+    # NaN fails both tests.
+    if not (0 < score < float("inf")):
+        return 0.0
+    return score
+
+
+class Engine(object):
+    """A population of genomes and their scores, evolved a generation at a time.
+
+    `fitness` is a function that takes a curve and returns a score, higher
+    for better curves and 0 for those that shouldn't breed; with more than
+    one worker it has to be defined at the top level of a module. If a
+    `checkpoint` file is given, the population is saved to it after every
+    generation and loaded from it if it exists already.
+    """
+
+    def __init__(self, fitness, size=DEFAULT_SIZE, workers=1, checkpoint=None):
+        self.fitness = fitness
+        self.size = size
+        self.checkpoint = checkpoint
+        self.generation = 0
+        self.genomes = []
+        self.scores = []
+        self.pool = None
+        if workers > 1 and multiprocessing:
+            self.pool = multiprocessing.Pool(workers)
+        if checkpoint and os.path.exists(checkpoint):
+            self.load(checkpoint)
+
+    def close(self):
+        if self.pool:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def score(self, genomes):
+        """Returns the scores of a list of genomes."""
+        work = [(self.fitness, genome) for genome in genomes]
+        if self.pool and len(work) > 1:
+            return self.pool.map(evaluate, work)
+        return map(evaluate, work)
+
+    def seed(self, genomes):
+        """Starts generation 0 from a list of genomes or lists of tokens."""
+        self.genomes = [genome if isinstance(genome, piclang.Genome)
+                        else piclang.Genome.from_tokens(genome) for genome in genomes]
+        self.scores = self.score(self.genomes)
+        self.generation = 0
+        if self.checkpoint:
+            self.save(self.checkpoint)
+
+    def step(self):
+        """Breeds the next generation from this one, replacing it.
+
+        Children that score 0 are bred again, up to MAX_BREED_ATTEMPTS
+        times; after that the generation is made up with them, or if there
+        are none, this one is kept.
+        """
+        scores = self.scores
+        if not sum(scores):
+            # Nothing scored, so let everything breed.
+            scores = [1] * len(self.genomes)
+        weights = ga.WeightedRandomGenerator(scores)
+        genomes, scores = [], []
+        unscored = []
+        seen = set()
+        for attempt in range(MAX_BREED_ATTEMPTS):
+            if len(genomes) >= self.size:
+                break
+            children = ga.breed(self.genomes, weights, self.size - len(genomes))
+            children = ga.screen(children, seen)
+            children = [genome for genome, parents, fingerprint in children]
+            for genome, score in zip(children, self.score(children)):
+                if score > 0:
+                    genomes.append(genome)
+                    scores.append(score)
+                else:
+                    unscored.append(genome)
+        if len(genomes) < self.size:
+            logging.warn("Only %d children scored after %d attempts",
+                         len(genomes), MAX_BREED_ATTEMPTS)
+            unscored = unscored[:self.size - len(genomes)]
+            genomes.extend(unscored)
+            scores.extend([0.0] * len(unscored))
+            if not genomes:
+                genomes, scores = self.genomes, self.scores
+        self.genomes, self.scores = genomes[:self.size], scores[:self.size]
+        self.generation += 1
+        if self.checkpoint:
+            self.save(self.checkpoint)
+
+    def run(self, generations):
+        """Evolves for a number of generations, logging how each one scored.
+
+        Returns the generations run per second.
+        """
+        start = time.time()
+        for i in range(generations):
+            self.step()
+            elapsed = time.time() - start
+            logging.info("Generation %d: best %.4g, mean %.4g, %.3g generations/s",
+                         self.generation, max(self.scores), sum(self.scores) / len(self.scores),
+                         (i + 1) / elapsed if elapsed else float("inf"))
+        elapsed = time.time() - start
+        return generations / elapsed if elapsed else float("inf")
+
+    def best(self, count=10):
+        """Returns the `count` highest scoring (score, genome) tuples."""
+        return sorted(zip(self.scores, self.genomes), key=lambda x: x[0], reverse=True)[:count]
+
+    def save(self, filename):
+        """Writes the population to a file, replacing it only once it's
+        been written in full."""
+        state = {
+            'generation': self.generation,
+            'genomes': [genome.tostring() for genome in self.genomes],
+            'scores': self.scores,
+        }
+        temporary = filename + ".tmp"
+        with open(temporary, "wb") as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        if os.name == 'nt' and os.path.exists(filename):
+            # Windows won't rename over an existing file.
+            os.remove(filename)
+        os.rename(temporary, filename)
+
+    def load(self, filename):
+        with open(filename, "rb") as f:
+            state = pickle.load(f)
+        self.generation = state['generation']
+        self.genomes = [piclang.Genome.fromstring(data) for data in state['genomes']]
+        self.scores = state['scores']
+
+
+def main(args):
+    import gen0
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    fitness = fitness_named(args[0])
+    generations = int(args[1])
+    checkpoint = args[2] if len(args) > 2 else None
+    size = int(args[3]) if len(args) > 3 else DEFAULT_SIZE
+    workers = int(args[4]) if len(args) > 4 else (multiprocessing.cpu_count() if multiprocessing else 1)
+    engine = Engine(fitness, size, workers, checkpoint)
+    try:
+        if not engine.genomes:
+            engine.seed(gen0.gen0_genomes)
+        rate = engine.run(generations)
+    finally:
+        engine.close()
+    print "Generation %d, %.3g generations/s" % (engine.generation, rate)
+    for score, genome in engine.best():
+        print "%10.4g  %r" % (score, genome)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -12,12 +12,14 @@ from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 from google.appengine.ext.deferred import defer
 from google.appengine.ext import ndb
+from google.appengine.ext.webapp import blobstore_handlers
 from webapp2_extras import jinja2
 
 import config
 import evolve
 import piclang
 import model
+import ranking
 
 organism_generation = None
 all_organisms = None
@@ -59,17 +61,20 @@ class BaseHandler(webapp2.RequestHandler):
 
 def genome_repr(g):
     genome = []
-    for instruction in g:
-        if isinstance(instruction, type) and issubclass(instruction, piclang.Curve):
-            genome.append(instruction.__name__)
-        elif isinstance(instruction, float):
-            genome.append("%.3f" % instruction)
-        elif isinstance(instruction, tuple):
-            genome.append("(%.3f, %.3f)" % instruction)
-        elif instruction == piclang.boustro:
-            genome.append("boustro")
+    values = iter(g.constants)
+    for opcode in g.opcodes:
+        if opcode == piclang.CIRCLE:
+            genome.append("circle")
+        elif opcode == piclang.LINE:
+            genome.append("line")
+        elif opcode == piclang.INTEGER:
+            genome.append("%d" % next(values))
+        elif opcode == piclang.NUMBER:
+            genome.append("%.3f" % next(values))
+        elif opcode == piclang.PAIR:
+            genome.append("(%.3f, %.3f)" % (next(values), next(values)))
         else:
-            genome.append(repr(instruction))
+            genome.append(piclang.OPERATORS[opcode - piclang.FIRST_OPERATOR].__name__)
     return ' '.join(genome)
 
 class IndividualHandler(BaseHandler):
@@ -117,6 +122,7 @@ class MatchupHandler(BaseHandler):
             logging.warn("Discarded vote (%d -> %d) with already used token %s", loser, winner, auth_token)
             return
         model.Vote.record(ndb.Key(model.Individual, loser), ndb.Key(model.Individual, winner), generation)
+        ranking.record(generation, winner, loser)
         vote_total = memcache.incr("votes", 1)
         if vote_total is None or vote_total > 500:
             # Vote counter has been evicted, or we're ready for a new generation
@@ -149,15 +155,29 @@ class MatchupHandler(BaseHandler):
 class BestHandler(BaseHandler):
     def get_best(self, generation, count):
         return model.Individual.query(model.Individual.generation == generation).order(model.Individual.rank).fetch(count)
+
+    def get_live_best(self, generation, count):
+        keys = model.Individual.query(model.Individual.generation == generation).fetch(keys_only=True)
+        ids = ranking.ranked(generation, [key.id() for key in keys])[:count]
+        return ndb.get_multi([ndb.Key(model.Individual, id) for id in ids])
         
     def get(self):
         bests = [(gen, self.get_best(gen, 5)) for gen in range(self.generation - 1, 0, -1)]
+        bests.insert(0, (self.generation, self.get_live_best(self.generation, 5)))
         self.render_template('best.html', bests=bests, active='best')
 
 
+class ImageHandler(blobstore_handlers.BlobstoreDownloadHandler):
+    def get(self, blob_key):
+        # Images never change once stored, so let browsers keep them.
+        self.response.headers['Cache-Control'] = 'public, max-age=31536000'
+        self.send_blob(blob_key, content_type='image/png')
+
+
 app = webapp2.WSGIApplication([
   (r'/', HomepageHandler),
   (r'/matchup', MatchupHandler),
   (r'/individual/(\d+)', IndividualHandler),
   (r'/best', BestHandler),
+  (r'/image/([^/]+)\.png', ImageHandler),
 ])
@@ -1,44 +1,152 @@
+import pickle
 import random
+from cStringIO import StringIO
 
+from google.appengine.api import datastore_errors
 from google.appengine.api import files
 from google.appengine.api import images
 from google.appengine.ext import ndb
 
 import piclang
+import rendercache
+
+# Size of the full image, and of the thumbnails rendered alongside it.
+IMAGE_SIZE = 800
+THUMBNAIL_SIZES = (64, 128, 512)
+# Number of renderings each instance keeps in memory.
+RENDER_CACHE_SIZE = 1000
+
+
+def render_pngs(genome):
+    """Renders a genome at every size, returning a list of PNG data.
+
+    The list is empty if the genome doesn't draw anything. Makes no API
+    calls, so it can run in a separate process.
+    """
+    fun = piclang.stackparse(genome, normalize=True)
+    if piclang.is_atom(fun):
+        return []
+    pictures = piclang.render(fun, points=8192, size=(IMAGE_SIZE,) + THUMBNAIL_SIZES, tolerance=0.5)
+    if not pictures:
+        return []
+    pngs = []
+    for picture in pictures:
+        buf = StringIO()
+        picture.save(buf, "PNG")
+        pngs.append(buf.getvalue())
+    return pngs
+
+
+def store_png(data):
+    """Saves PNG data to the blobstore, returning its blob key."""
+    filename = files.blobstore.create(mime_type='image/png')
+    with files.open(filename, 'a') as f:
+        f.write(data)
+    files.finalize(filename)
+    return files.blobstore.get_blob_key(filename)
+
+
+class Thumbnail(ndb.Model):
+    size = ndb.IntegerProperty(required=True)
+    image = ndb.BlobKeyProperty(required=True)
+
+
+class Rendering(ndb.Model):
+    """The images for a curve, keyed by `piclang.fingerprint` of the curve."""
+    image = ndb.BlobKeyProperty(required=True)
+    thumbnails = ndb.StructuredProperty(Thumbnail, repeated=True)
+
+
+render_cache = rendercache.RenderCache(Rendering, RENDER_CACHE_SIZE)
+
+
+class GenomeProperty(ndb.BlobProperty):
+    """Stores a piclang.Genome as its compact string form.
+
+    Also reads genomes stored by the PickleProperty this replaced, as
+    pickled lists of tokens, and accepts lists of tokens when set.
+    """
+
+    def _validate(self, value):
+        if isinstance(value, list):
+            return piclang.Genome.from_tokens(value)
+        if not isinstance(value, piclang.Genome):
+            raise datastore_errors.BadValueError("Expected a Genome, got %r" % (value,))
+
+    def _to_base_type(self, value):
+        return value.tostring()
+
+    def _from_base_type(self, value):
+        if value.startswith(piclang.Genome.MAGIC):
+            return piclang.Genome.fromstring(value)
+        return piclang.Genome.from_tokens(pickle.loads(value))
+
 
 class Individual(ndb.Model):
-    genome = ndb.PickleProperty(compressed=True)
+    genome = GenomeProperty()
     generation = ndb.IntegerProperty(required=True)
     parents = ndb.KeyProperty(kind='Individual', repeated=True)
     score = ndb.FloatProperty() # Fitness score within this generation
     rank = ndb.IntegerProperty() # Rank within this generation
     image = ndb.BlobKeyProperty(required=True)
+    thumbnails = ndb.StructuredProperty(Thumbnail, repeated=True)
     random = ndb.ComputedProperty(lambda self: random.random())
 
     @classmethod
-    def create(cls, genome, generation, parents, store=False):
-        fun = piclang.stackparse(genome, normalize=True)
-        if piclang.is_atom(fun):
-            return None
-        image = piclang.render(fun, points=8192)
-        if not image:
-            return None
-        filename = files.blobstore.create(mime_type='image/png')
-        with files.open(filename, 'a') as f:
-            image.save(f, "PNG")
-        files.finalize(filename)
-        blob_key = files.blobstore.get_blob_key(filename)
+    def create(cls, genome, generation, parents, store=False, pngs=None,
+               fingerprint=None, rendering=None, renderings=None):
+        """Creates an individual, or returns None if its genome draws nothing.
+
+        A caller that has already pruned the genome and worked out the
+        fingerprint of its curve can pass it as `fingerprint`, and one that
+        has looked it up in `render_cache` can pass what it found: either
+        the Rendering as `rendering`, or the result of calling `render_pngs`
+        on the genome as `pngs`, in which case the cache isn't checked again.
+        A new Rendering is written along with the individual if `store` is
+        set, or at once if not, unless a list is passed as `renderings`: then
+        it's appended to that for the caller to write.
+        """
+        new_rendering = None
+        if fingerprint is None:
+            fun = piclang.stackparse(genome, normalize=True)
+            if piclang.is_atom(fun):
+                return None
+            fingerprint = piclang.fingerprint(fun)
+        if rendering is None and pngs is None:
+            rendering = render_cache.get(fingerprint)
+        if not rendering:
+            if pngs is None:
+                pngs = render_pngs(genome)
+            if not pngs:
+                return None
+            blob_keys = [store_png(data) for data in pngs]
+            rendering = new_rendering = render_cache.put(
+                fingerprint,
+                store=False,
+                image=blob_keys[0],
+                thumbnails=[Thumbnail(size=size, image=blob_key)
+                            for size, blob_key in zip(THUMBNAIL_SIZES, blob_keys[1:])])
         individual = cls(
             genome=genome,
             generation=generation,
             parents=parents,
-            image=blob_key
+            image=rendering.image,
+            thumbnails=rendering.thumbnails
         )
-        if store:
-            individual.put()
+        entities = [individual] if store else []
+        if new_rendering:
+            if renderings is not None:
+                renderings.append(new_rendering)
+            else:
+                entities.append(new_rendering)
+        if entities:
+            ndb.put_multi(entities)
         return individual
 
     def image_url(self, size=None):
+        for thumbnail in self.thumbnails:
+            if thumbnail.size == size:
+                return '/image/%s.png' % (thumbnail.image,)
         return images.get_serving_url(self.image, size=size)
 
     def as_dict(self, size=None):
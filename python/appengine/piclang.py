@@ -118,23 +118,54 @@ ultimate emptiness of the pursuit of knowledge.  For example,
 iteration of the curve is time-reversed, so it doesn’t introduce any
 discontinuities.
 
+## Discontinuities ##
+
+Every curve can list the values of t at which it might jump, worked out
+from the structure of the expression, and `interpolate_segments` uses
+them to sample a curve as a list of continuous pieces.  `render` draws
+those pieces separately, so it doesn’t draw spurious lines across the
+jumps.
+
+## Rendering ##
+
+With NumPy, `render` can rasterize the whole curve at once instead of
+drawing each segment with PIL.  The curve is resampled a pixel apart,
+each pixel remembers how far along the curve it was drawn, and a pixel
+gets ink if the nearest bit of curve is not passed over later by the
+gap around the pen.  That is the same over-and-under effect that
+drawing a wide background-coloured line before each segment gives, at
+a cost that depends on the image size rather than the number of
+points, so `render` only uses it for images with many points for
+their size.  `antialias=n` renders n times larger and scales down,
+and always rasterizes.
+
 ## BUGS ##
 
-We still draw spurious lines between points that are separated by
-discontinuities, which sometimes introduces spurious asymmetries in
-the image.
+Discontinuities are only found for `**` and `//` by constant amounts.
 
-We don’t yet adjust sampling density to avoid aliasing problems and
-jaggies on complicated curves.
+Sampling density is only adjusted to avoid aliasing problems and
+jaggies on complicated curves if you ask for it with
+`adaptive_interpolate`, or by passing a `tolerance` to `render`.
 
 There is not yet a way to see changes in your curve as you edit the
 formula.
 
 """
 
+import array
+import collections
+import hashlib
 import inspect
+import itertools
 import math
 import numbers
+import operator
+import struct
+import sys
+try:
+    import numpy
+except ImportError:
+    numpy = None
 try:
     import readline
 except ImportError:
@@ -144,6 +175,11 @@ try:
 except ImportError:
     import Image, ImageDraw
 
+# Curves that may jump at more values of t than this aren't checked for
+# jumps at all. Each curve checks the size of its list before building it,
+# so nesting can't get round the limit.
+MAX_DISCONTINUITIES = 100000
+
 class Curve(object):
     @classmethod
     def wrap(cls, o):
@@ -151,12 +187,46 @@ class Curve(object):
             return o
         if callable(o):
             return FunctionCurve(o)
-        if isinstance(o, numbers.Number):
+        if isinstance(o, (int, float)) or isinstance(o, numbers.Number):
             return cls.wrap((o, o))
         if isinstance(o, tuple) and len(o) == 2:
             return constant(o)
         raise TypeError("Expected function, number, or 2-tuple, got %r, a %r" % (o, type(o)))
 
+    def evaluate(self, ts):
+        """Evaluates the curve at every value in the array `ts`.
+
+        Returns an (xs, ys) pair. Either may be a scalar rather than an
+        array if it doesn't vary with t; it will broadcast against `ts`.
+        """
+        points = numpy.array([self(t) for t in ts], dtype=float)
+        points = points.reshape(-1, 2)
+        return points[:, 0], points[:, 1]
+
+    def discontinuities(self):
+        """Returns a sorted list of the values of t at which the curve may jump.
+
+        Curves that don't know better are assumed to be continuous.
+        """
+        return []
+
+    def emit(self, compiler, t):
+        """Emits code that evaluates this curve at `t` into `compiler`.
+
+        Returns the (x, y) value, as a pair of names or numbers. Curves
+        that don't know how to compile themselves are simply called.
+        """
+        return compiler.unpack("%s(%s)" % (compiler.bind(self), t))
+
+    def compile(self):
+        """Compiles the curve into a single Python function.
+
+        Returns a CompiledCurve that computes the same values as this one
+        with a single function call per sample.
+        """
+        tree = share(self)
+        return CompiledCurve(tree, *CurveCompiler().build(tree))
+
     def __add__(self, other):
         return translate(self, other)
 
@@ -189,6 +259,9 @@ class FunctionCurve(Curve):
     def __call__(self, t):
         return self.func(t)
 
+    def emit(self, compiler, t):
+        return compiler.unpack("%s(%s)" % (compiler.bind(self.func), t))
+
     def __repr__(self):
         return self.func.__name__
 
@@ -204,6 +277,20 @@ class TwoArgCurve(Curve):
     def __call__(self, t):
         return self.invoke(self.a(t), self.b(t))
 
+    def evaluate(self, ts):
+        return self.invoke(self.a.evaluate(ts), self.b.evaluate(ts))
+
+    def discontinuities(self):
+        a, b = self.a.discontinuities(), self.b.discontinuities()
+        if len(a) + len(b) > MAX_DISCONTINUITIES:
+            return []
+        return sorted(set(a) | set(b))
+
+    def emit(self, compiler, t):
+        a = compiler.emit(self.a, t)
+        b = compiler.emit(self.b, t)
+        return self.emit_invoke(compiler, a, b)
+
     def __repr__(self):
         l = repr(self.a)
         r = repr(self.b)
@@ -224,6 +311,12 @@ class constant(Curve):
     def __call__(self, t):
         return self.val
 
+    def evaluate(self, ts):
+        return self.val
+
+    def emit(self, compiler, t):
+        return self.val
+
     def __repr__(self):
         if self.val[0] == self.val[1]:
             return "%.3f" % self.val[0]
@@ -238,6 +331,9 @@ class translate(TwoArgCurve):
     def invoke(self, (ax, ay), (bx, by)):
         return (ax + bx, ay + by)
 
+    def emit_invoke(self, c, (ax, ay), (bx, by)):
+        return (c.op(ax, "+", bx), c.op(ay, "+", by))
+
 
 class scale(TwoArgCurve):
     OPERATOR = "*"
@@ -246,11 +342,18 @@ class scale(TwoArgCurve):
     def invoke(self, (ax, ay), (bx, by)):
         return (ax * bx, ay * by)
 
+    def emit_invoke(self, c, (ax, ay), (bx, by)):
+        return (c.op(ax, "*", bx), c.op(ay, "*", by))
+
 
 class rotate(TwoArgCurve):
     def invoke(self, (ax, ay), (bx, by)):
         return (ax * bx - ay * by, ay * bx + ax * by)
 
+    def emit_invoke(self, c, (ax, ay), (bx, by)):
+        return (c.op(c.op(ax, "*", bx), "-", c.op(ay, "*", by)),
+                c.op(c.op(ay, "*", bx), "+", c.op(ax, "*", by)))
+
 
 class reverse(Curve):
     def __init__(self, func):
@@ -259,6 +362,15 @@ class reverse(Curve):
     def __call__(self, t):
         return self.func(1 - t)
 
+    def evaluate(self, ts):
+        return self.func.evaluate(1 - ts)
+
+    def discontinuities(self):
+        return [1 - d for d in reversed(self.func.discontinuities())]
+
+    def emit(self, compiler, t):
+        return compiler.emit(self.func, compiler.op(1, "-", t))
+
     def __repr__(self):
         return "reverse(%r)" % (self.func,)
 
@@ -274,6 +386,35 @@ class concat(Curve):
         else:
             return self.b(t * 2 - 1)
 
+    def evaluate(self, ts):
+        first = ts < 0.5
+        second = ~first
+        xs = numpy.empty(len(ts))
+        ys = numpy.empty(len(ts))
+        xs[first], ys[first] = self.a.evaluate(ts[first] * 2)
+        xs[second], ys[second] = self.b.evaluate(ts[second] * 2 - 1)
+        return xs, ys
+
+    def discontinuities(self):
+        a, b = self.a.discontinuities(), self.b.discontinuities()
+        if len(a) + len(b) + 1 > MAX_DISCONTINUITIES:
+            return []
+        return [d / 2 for d in a] + [0.5] + [(1 + d) / 2 for d in b]
+
+    def emit(self, c, t):
+        x, y = c.name(), c.name()
+        c.line("if %s < 0.5:" % t)
+        c.indent()
+        a = c.emit(self.a, c.op(t, "*", 2))
+        c.line("%s, %s = %s, %s" % (x, y, c.format(a[0]), c.format(a[1])))
+        c.dedent()
+        c.line("else:")
+        c.indent()
+        b = c.emit(self.b, c.op(c.op(t, "*", 2), "-", 1))
+        c.line("%s, %s = %s, %s" % (x, y, c.format(b[0]), c.format(b[1])))
+        c.dedent()
+        return x, y
+
     def __repr__(self):
         return "concat(%r, %r)" % (self.a, self.b)
 
@@ -286,6 +427,29 @@ class repeat(Curve):
     def __call__(self, t):
         return self.func((t * self.times(t)[0]) % 1)
 
+    def evaluate(self, ts):
+        times = self.times.evaluate(ts)[0]
+        return self.func.evaluate((ts * times) % 1)
+
+    def discontinuities(self):
+        if not isinstance(self.times, constant):
+            return []
+        times = float(self.times.val[0])
+        count = int(math.ceil(abs(times)))
+        if count > MAX_DISCONTINUITIES:
+            return []
+        inner = self.func.discontinuities()
+        if count * (len(inner) + 1) > MAX_DISCONTINUITIES:
+            return []
+        if times < 0:
+            inner = [1 - d for d in inner]
+        ts = ((k + d) / abs(times) for k in range(count) for d in [0] + inner)
+        return sorted(t for t in ts if 0 < t < 1)
+
+    def emit(self, c, t):
+        times = c.emit(self.times, t)[0]
+        return c.emit(self.func, c.op(c.op(t, "*", times), "%", 1))
+
     def __repr__(self):
         l = repr(self.func)
         if getattr(self.func, 'PRECEDENCE', 0) > 0:
@@ -306,6 +470,31 @@ class step(Curve):
             val = math.floor(t * steps) / steps
         return self.func(val)
 
+    def evaluate(self, ts):
+        steps = self.steps.evaluate(ts)[0]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            vals = numpy.where(steps == 0, 0, numpy.floor(ts * steps) / steps)
+        return self.func.evaluate(vals)
+
+    def discontinuities(self):
+        if not isinstance(self.steps, constant) or self.steps.val[0] == 0:
+            return []
+        steps = abs(float(self.steps.val[0]))
+        count = int(math.ceil(steps))
+        if count > MAX_DISCONTINUITIES:
+            return []
+        return [k / steps for k in range(1, count)]
+
+    def emit(self, c, t):
+        steps = c.emit(self.steps, t)[0]
+        if c.is_constant(steps):
+            if steps == 0:
+                return c.emit(self.func, 0)
+            val = c.op(c.call("floor", c.op(t, "*", steps)), "/", steps)
+        else:
+            val = c.assign("floor(%s * %s) / %s if %s != 0 else 0" % (t, steps, steps, steps))
+        return c.emit(self.func, val)
+
     def __repr__(self):
         l = repr(self.func)
         if getattr(self.func, 'PRECEDENCE', 0) > 0:
@@ -317,6 +506,14 @@ class PlatonicCircle(Curve):
         theta = 2 * math.pi * t
         return (math.sin(theta), math.cos(theta))
 
+    def evaluate(self, ts):
+        theta = 2 * math.pi * ts
+        return numpy.sin(theta), numpy.cos(theta)
+
+    def emit(self, compiler, t):
+        theta = compiler.op(2 * math.pi, "*", t)
+        return compiler.call("sin", theta), compiler.call("cos", theta)
+
     def __repr__(self):
         return "circle"
 
@@ -326,6 +523,12 @@ class PlatonicLine(Curve):
     def __call__(self, t):
         return (t, t)
 
+    def evaluate(self, ts):
+        return ts, ts
+
+    def emit(self, compiler, t):
+        return t, t
+
     def __repr__(self):
         return "line"
 
@@ -341,11 +544,406 @@ class boustro(Curve):
         else:
             return self.func((1 - t) * 2)
 
+    def evaluate(self, ts):
+        return self.func.evaluate(numpy.where(ts < 0.5, ts * 2, (1 - ts) * 2))
+
+    def discontinuities(self):
+        inner = self.func.discontinuities()
+        if 2 * len(inner) > MAX_DISCONTINUITIES:
+            return []
+        return [d / 2 for d in inner] + [1 - d / 2 for d in reversed(inner)]
+
+    def emit(self, compiler, t):
+        val = compiler.assign("%s * 2 if %s < 0.5 else (1 - %s) * 2" % (t, t, t))
+        return compiler.emit(self.func, val)
+
     def __repr__(self):
         return "boustro(%r)" % self.func
 
+class CompiledCurve(Curve):
+    """A curve whose scalar evaluation has been compiled to one function.
+
+    Vectorized evaluation is delegated to the original tree, which
+    already does a single pass over the whole array per node.
+    """
+    def __init__(self, tree, func, source):
+        self.tree = tree
+        self.func = func
+        self.source = source
+
+    def __call__(self, t):
+        return self.func(t)
+
+    def evaluate(self, ts):
+        return self.tree.evaluate(ts)
+
+    def discontinuities(self):
+        return self.tree.discontinuities()
+
+    def emit(self, compiler, t):
+        return compiler.emit(self.tree, t)
+
+    def compile(self):
+        return self
+
+    def __repr__(self):
+        return repr(self.tree)
+
+
+class SharedCurve(Curve):
+    """A subtree that is used in more than one place in a curve.
+
+    Remembers the last value it computed, so that it's only evaluated once
+    per sample, or once per array of samples, however often it's used.
+    """
+    def __init__(self, func):
+        self.func = func
+        self._t = self._value = None
+        self._ts = self._values = None
+
+    def __call__(self, t):
+        if t != self._t:
+            self._value = self.func(t)
+            self._t = t
+        return self._value
+
+    def evaluate(self, ts):
+        if ts is not self._ts:
+            self._values = self.func.evaluate(ts)
+            self._ts = ts
+        return self._values
+
+    def discontinuities(self):
+        return self.func.discontinuities()
+
+    def emit(self, compiler, t):
+        return compiler.emit_shared(self, t)
+
+    def __repr__(self):
+        return repr(self.func)
+
+
+def share(curve):
+    """Returns a copy of `curve` in which identical subtrees are shared.
+
+    Subtrees are compared by structure, not identity. Any that appear more
+    than once are replaced by a single SharedCurve.
+    """
+    keys = {}
+    counts = collections.defaultdict(int)
+    shared = {}
+
+    def unwrap(node):
+        if isinstance(node, CompiledCurve):
+            return unwrap(node.tree)
+        if isinstance(node, SharedCurve):
+            return unwrap(node.func)
+        return node
+
+    def key(node):
+        node = unwrap(node)
+        if id(node) not in keys:
+            fields = tuple((name, key(value) if isinstance(value, Curve) else value)
+                           for name, value in sorted(vars(node).items()))
+            keys[id(node)] = (type(node), fields)
+        return keys[id(node)]
+
+    def count(node):
+        node = unwrap(node)
+        k = key(node)
+        counts[k] += 1
+        if counts[k] == 1:
+            for value in vars(node).values():
+                if isinstance(value, Curve):
+                    count(value)
+
+    def rebuild(node):
+        node = unwrap(node)
+        k = key(node)
+        if k not in shared:
+            result = object.__new__(type(node))
+            for name, value in vars(node).items():
+                if isinstance(value, Curve):
+                    value = rebuild(value)
+                setattr(result, name, value)
+            if counts[k] > 1 and not isinstance(node, (constant, PlatonicLine)):
+                result = SharedCurve(result)
+            shared[k] = result
+        return shared[k]
+
+    curve = Curve.wrap(curve)
+    count(curve)
+    return rebuild(curve)
+
+
+def fingerprint(curve):
+    """Returns a hash that is the same for any two curves built the same way.
+
+    Unlike `repr`, which rounds constants, this tells apart any two curves
+    that could be drawn differently.
+    """
+    def describe(node):
+        if isinstance(node, CompiledCurve):
+            return describe(node.tree)
+        if isinstance(node, SharedCurve):
+            return describe(node.func)
+        if isinstance(node, numbers.Real):
+            return repr(float(node))
+        if isinstance(node, tuple):
+            return "(%s)" % ", ".join(describe(value) for value in node)
+        if not isinstance(node, Curve):
+            return repr(node)
+        return "%s(%s)" % (type(node).__name__, ", ".join(
+            "%s=%s" % (name, describe(value)) for name, value in sorted(vars(node).items())))
+
+    return hashlib.sha1(describe(Curve.wrap(curve))).hexdigest()
+
+
+class CurveCompiler(object):
+    """Generates the source for a Python function that evaluates a curve.
+
+    Values are passed around as either numbers, which are known at compile
+    time and get folded, or as the names of local variables.
+    """
+    OPERATORS = {
+        "+": operator.add,
+        "-": operator.sub,
+        "*": operator.mul,
+        "/": operator.truediv,
+        "%": operator.mod,
+    }
+
+    def __init__(self):
+        self.namespace = {"sin": math.sin, "cos": math.cos, "floor": math.floor}
+        self.lines = []
+        self._indent = 1
+        self._names = 0
+        self._shared = [{}]
+
+    def build(self, curve):
+        """Compiles `curve`, returning a (function, source) tuple."""
+        x, y = self.emit(curve, "t")
+        self.line("return (%s, %s)" % (self.format(x), self.format(y)))
+        source = "def curve(t):\n%s\n" % "\n".join(self.lines)
+        exec compile(source, "<piclang %r>" % (curve,), "exec") in self.namespace
+        return self.namespace["curve"], source
+
+    def emit(self, curve, t):
+        if self.is_constant(t):
+            return curve(t)
+        return curve.emit(self, t)
+
+    def emit_shared(self, curve, t):
+        """Emits a shared subtree, reusing its value if it's already known."""
+        known = self._shared[-1]
+        if (id(curve), t) not in known:
+            known[id(curve), t] = self.emit(curve.func, t)
+        return known[id(curve), t]
+
+    def is_constant(self, value):
+        return isinstance(value, numbers.Number)
+
+    def format(self, value):
+        if self.is_constant(value):
+            return repr(value)
+        return value
+
+    def name(self):
+        self._names += 1
+        return "v%d" % self._names
+
+    def bind(self, obj):
+        """Makes `obj` available to the generated code, returning its name."""
+        name = "_%s" % self.name()
+        self.namespace[name] = obj
+        return name
+
+    def line(self, text):
+        self.lines.append("    " * self._indent + text)
+
+    def indent(self):
+        self._indent += 1
+        self._shared.append(dict(self._shared[-1]))
+
+    def dedent(self):
+        self._indent -= 1
+        self._shared.pop()
+
+    def assign(self, expr):
+        name = self.name()
+        self.line("%s = %s" % (name, expr))
+        return name
+
+    def unpack(self, expr):
+        x, y = self.name(), self.name()
+        self.line("%s, %s = %s" % (x, y, expr))
+        return x, y
+
+    def call(self, func, arg):
+        if self.is_constant(arg):
+            return self.namespace[func](arg)
+        return self.assign("%s(%s)" % (func, arg))
+
+    def op(self, a, op, b):
+        """Emits `a op b`, folding it where either side is a known number."""
+        if self.is_constant(a) and self.is_constant(b):
+            return self.OPERATORS[op](a, b)
+        if op == "+" and a == 0:
+            return b
+        if op in "+-" and b == 0:
+            return a
+        if op == "*":
+            if a == 0 or b == 0:
+                return 0.0
+            if a == 1:
+                return b
+            if b == 1:
+                return a
+        return self.assign("%s %s %s" % (self.format(a), op, self.format(b)))
+
+
 def interpolate(f, points):
-    return [f(x/float(points)) for x in range(points)]
+    if numpy is None:
+        if isinstance(f, CompiledCurve):
+            f = f.func
+        else:
+            f = share(f)
+        return [f(x/float(points)) for x in range(points)]
+    xs, ys = interpolate_array(f, points)
+    return zip(xs.tolist(), ys.tolist())
+
+def interpolate_array(f, points):
+    """Like interpolate, but evaluates the whole curve at once with numpy.
+
+    Returns a pair of arrays (xs, ys), each `points` long.
+    """
+    ts = numpy.arange(points) / float(points)
+    return evaluate_array(share(f), ts)
+
+def evaluate_array(f, ts):
+    """Evaluates a curve at every t in `ts`, returning arrays (xs, ys)."""
+    xs, ys = f.evaluate(ts)
+    zeros = numpy.zeros(len(ts))
+    return xs + zeros, ys + zeros
+
+ADAPTIVE_MIN_POINTS = 101
+# The golden ratio, whose multiples are spread evenly around [0, 1) mod 1.
+GOLDEN = (1 + 5 ** 0.5) / 2
+
+def sample_grid(points, start=0, end=None):
+    """Returns the values of t numbered start to end - 1 of `points` samples
+    across [0, 1) that are spaced unevenly, so that they don't alias with a
+    curve repeated any number of times.
+
+    Each falls in its own interval of width 1 / points, moved up it by up
+    to half the width by an amount that doesn't repeat. The first is 0.
+    """
+    if end is None:
+        end = points
+    k = numpy.arange(start, end)
+    return (k + (k * GOLDEN % 1) / 2) / float(points)
+
+def adaptive_interpolate(f, tolerance, min_points=ADAPTIVE_MIN_POINTS, max_points=65536):
+    """Samples a curve more densely where it bends more sharply.
+
+    `tolerance` is the furthest the drawn line may stray from the curve
+    between samples. Returns at most `max_points` points.
+    """
+    if numpy is None:
+        return interpolate(f, max_points)
+    xs, ys = adaptive_interpolate_array(f, tolerance, min_points, max_points)
+    return zip(xs.tolist(), ys.tolist())
+
+def adaptive_interpolate_array(f, tolerance, min_points=ADAPTIVE_MIN_POINTS, max_points=65536,
+                               scale=(1, 1)):
+    """Like adaptive_interpolate, but returns a pair of arrays (xs, ys).
+
+    Starts with `min_points` samples from sample_grid and one at
+    (max_points - 1) / max_points, so that it ends where interpolate with
+    `max_points` points would, then repeatedly splits each interval whose
+    midpoint is more than `tolerance` away from the chord between its
+    ends. Errors are measured after multiplying by
+    `scale`, so the tolerance can be given in output units. If there isn't
+    room for every split, the worst intervals are split first.
+    """
+    min_points = min(min_points, max_points)
+    ts = numpy.union1d(sample_grid(min_points), [(max_points - 1) / float(max_points)])
+    return refine(share(f), ts, tolerance, max_points, scale)[1:]
+
+def refine(f, ts, tolerance, max_points, scale=(1, 1), jumps=()):
+    """Adds samples between the values in `ts` until f is within tolerance.
+
+    Intervals that start at one of the values in `jumps` are left alone.
+    Returns arrays (ts, xs, ys).
+    """
+    xs, ys = evaluate_array(f, ts)
+    sx, sy = scale
+    while len(ts) < max_points:
+        mid = (ts[:-1] + ts[1:]) / 2
+        mx, my = evaluate_array(f, mid)
+        error = chord_error(mx * sx, my * sy, xs[:-1] * sx, ys[:-1] * sy, xs[1:] * sx, ys[1:] * sy)
+        error[numpy.in1d(ts[:-1], jumps)] = 0
+        split = numpy.flatnonzero(error > tolerance)
+        if not len(split):
+            break
+        room = max_points - len(ts)
+        if len(split) > room:
+            split = split[numpy.argsort(error[split])[-room:]]
+        order = numpy.argsort(numpy.concatenate((ts, mid[split])), kind='mergesort')
+        ts = numpy.concatenate((ts, mid[split]))[order]
+        xs = numpy.concatenate((xs, mx[split]))[order]
+        ys = numpy.concatenate((ys, my[split]))[order]
+    return ts, xs, ys
+
+# How far either side of a discontinuity to look for a jump.
+DISCONTINUITY_EPSILON = 1e-9
+
+# The smallest jump that counts as one when sampling without a tolerance.
+MIN_JUMP = 1e-3
+
+def find_discontinuities(f, threshold, scale=(1, 1)):
+    """Returns an array of the values of t at which f jumps by more than `threshold`."""
+    eps = DISCONTINUITY_EPSILON
+    ds = numpy.array([d for d in f.discontinuities() if eps < d < 1 - eps])
+    before = evaluate_array(f, ds - eps)
+    after = evaluate_array(f, ds + eps)
+    gaps = numpy.hypot((after[0] - before[0]) * scale[0], (after[1] - before[1]) * scale[1])
+    return ds[gaps > threshold]
+
+def interpolate_segments(f, points, tolerance=None, scale=(1, 1)):
+    """Samples a curve as a list of continuous pieces, split where it jumps.
+
+    Samples `points` evenly spaced points, or if `tolerance` is given, up to
+    `points` points placed as by adaptive_interpolate. Returns a list of
+    (xs, ys) pairs, one for each piece.
+    """
+    if numpy is None:
+        return [zip(*interpolate(f, points))]
+    f = share(f)
+    jumps = find_discontinuities(f, tolerance or MIN_JUMP, scale)
+    starts = jumps - DISCONTINUITY_EPSILON
+    if tolerance is None:
+        grid = numpy.arange(points) / float(points)
+    else:
+        grid = numpy.union1d(sample_grid(min(ADAPTIVE_MIN_POINTS, points)),
+                             [(points - 1) / float(points)])
+    ts = numpy.union1d(grid, numpy.concatenate((starts, jumps)))
+    if tolerance is None:
+        xs, ys = evaluate_array(f, ts)
+    else:
+        ts, xs, ys = refine(f, ts, tolerance, points + 2 * len(jumps), scale, starts)
+    breaks = numpy.flatnonzero(numpy.in1d(ts, starts)) + 1
+    return zip(numpy.split(xs, breaks), numpy.split(ys, breaks))
+
+def chord_error(px, py, ax, ay, bx, by):
+    """Returns the distances from points p to the segments a-b, elementwise."""
+    dx = bx - ax
+    dy = by - ay
+    length = dx * dx + dy * dy
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        u = numpy.where(length > 0, ((px - ax) * dx + (py - ay) * dy) / length, 0)
+    u = numpy.clip(u, 0, 1)
+    return numpy.hypot(px - (ax + u * dx), py - (ay + u * dy))
 
 def normalize(pts, w, h):
     """Scales the list of points to fit in a rectangle (0, 0) - (w, h)"""
@@ -363,68 +961,501 @@ def normalize(pts, w, h):
     
     return [((x - xmin) * xscale, (y - ymin) * yscale) for x, y in pts]
 
-def render(f, points=1000, size=800, penwidth=6, gapwidth=6, bgcolor=(0, 0, 0), fgcolor=(255, 255, 255)):
+def normalize_array(xs, ys, w, h):
+    """Like normalize, but for arrays of x and y coordinates."""
+    xmin, xmax = xs.min(), xs.max()
+    ymin, ymax = ys.min(), ys.max()
+    if xmax - xmin == 0 or ymax - ymin == 0:
+        return None
+    return (xs - xmin) * (w / (xmax - xmin)), (ys - ymin) * (h / (ymax - ymin))
+
+# PIL's drawing time grows with the number of points and rasterize's with
+# the number of pixels. Rasterizing is quicker once there is a point for
+# every this many pixels.
+RASTERIZE_PIXELS_PER_POINT = 50
+
+def render(f, points=1000, size=800, penwidth=6, gapwidth=6, bgcolor=(0, 0, 0), fgcolor=(255, 255, 255),
+           tolerance=None, antialias=1):
+    """Draws a curve, scaled to fill a square image `size` pixels across.
+
+    Samples `points` evenly spaced points, or if `tolerance` is given, up to
+    `points` points placed so the line is never more than `tolerance`
+    pixels from the curve.  `antialias` supersamples by that factor, using
+    rasterize; otherwise each image is drawn by whichever of rasterize and
+    draw_paths is quicker for its size.
+
+    If `size` is a list of sizes, the curve is sampled once for the largest
+    and a list of images is returned, one per size, each drawn at its own
+    resolution with the pen and gap scaled down to match.
+    """
+    many = isinstance(size, (list, tuple))
+    sizes = size if many else [size]
+    largest = max(sizes)
+    images = []
+    if numpy is None:
+        point_list = normalize(interpolate(f, points), largest, largest)
+        if not point_list:
+            return None
+        for width in sizes:
+            ratio = float(width) / largest
+            images.append(draw_paths(
+                [[(x * ratio, y * ratio) for x, y in point_list]], width,
+                max(1, int(round(penwidth * ratio))), int(round(gapwidth * ratio)),
+                bgcolor, fgcolor))
+    else:
+        f = share(f)
+        scale = (1, 1)
+        if tolerance is not None:
+            # Measure the tolerance in pixels of the largest image.
+            coarse = evaluate_array(f, sample_grid(ADAPTIVE_MIN_POINTS))
+            scale = [largest / a.ptp() if a.ptp() > 0 else 1 for a in coarse]
+        segments = interpolate_segments(f, points, tolerance, scale)
+        scaled = normalize_array(numpy.concatenate([xs for xs, ys in segments]),
+                                 numpy.concatenate([ys for xs, ys in segments]), largest, largest)
+        if scaled is None:
+            return None
+        breaks = numpy.cumsum([len(xs) for xs, ys in segments])[:-1]
+        paths = zip(*[numpy.split(a, breaks) for a in scaled])
+        count = len(scaled[0])
+        for width in sizes:
+            ratio = float(width) / largest
+            if antialias == 1 and count * RASTERIZE_PIXELS_PER_POINT < width * width:
+                images.append(draw_paths(
+                    [zip((xs * ratio).tolist(), (ys * ratio).tolist()) for xs, ys in paths], width,
+                    max(1, int(round(penwidth * ratio))), int(round(gapwidth * ratio)),
+                    bgcolor, fgcolor))
+            else:
+                images.append(rasterize(
+                    [(xs * ratio, ys * ratio) for xs, ys in paths], width,
+                    penwidth * ratio, gapwidth * ratio, bgcolor, fgcolor, antialias))
+    return images if many else images[0]
+
+def draw_paths(paths, size, penwidth, gapwidth, bgcolor, fgcolor):
+    """Draws lists of points segment by segment with PIL."""
     im = Image.new("RGB", (size, size), bgcolor)
     draw = ImageDraw.Draw(im)
-    point_list = normalize(interpolate(f, points), size, size)
-    if not point_list:
-        return None
-    for src, dest in zip(point_list, point_list[1:]):
-        draw.line((src, dest), fill=bgcolor, width=penwidth+gapwidth*2)
-        draw.line((src, dest), fill=fgcolor, width=penwidth)
+    for point_list in paths:
+        for src, dest in zip(point_list, point_list[1:]):
+            draw.line((src, dest), fill=bgcolor, width=penwidth+gapwidth*2)
+            draw.line((src, dest), fill=fgcolor, width=penwidth)
     return im
 
-class PicStack(object):
-    def __init__(self):
-        self._stack = []
-        self._stackptr = 0 # Points to the first index that's not in the stack
-    
-    def _popone(self):
-        if not self._stack:
-            return (0, frozenset())
-        self._stackptr -= 1
-        if self._stackptr < 0:
-            self._stackptr = min(len(self._stack), 8) - 1
-        return self._stack[self._stackptr]
-    
-    def pop(self, num=1):
-        ret = [self._popone() for i in range(num)]
-        ret.reverse()
-        return ret
-
-    def push(self, elt):
-        if self._stackptr < len(self._stack):
-            self._stack[self._stackptr] = elt
-        else:
-            self._stack.append(elt)
-        self._stackptr += 1
+def _max_filter(levels, radius, pad, shape):
+    """Takes the maximum of a padded, flattened image over a disc.
+
+    `levels[j]` holds the maximum over 2**j pixels starting at each pixel.
+    Works in from the top and bottom rows of the disc, each row's span
+    being at least as wide as the rows outside it, so the result for row
+    k can be built from the result for row k+1 moved a row up and down.
+    """
+    height, width = shape
+    stride = width + 2 * pad
+    result = None
+    spans = {}
+    for k in range(int(radius), -1, -1):
+        half = int(math.sqrt(radius * radius - k * k))
+        if half not in spans:
+            j = (2 * half + 1).bit_length() - 1
+            spans = {half: (levels[j], -half, half + 1 - (1 << j))}
+        level, left, right = spans[half]
+        start = (pad - k) * stride
+        n = (height + 2 * k) * stride
+        row = numpy.maximum(level[start + left:start + left + n],
+                            level[start + right:start + right + n])
+        if result is not None:
+            numpy.maximum(row, result[:n], row)
+            numpy.maximum(row, result[2 * stride:2 * stride + n], row)
+        result = row
+    return result.reshape(height, stride)[:, pad:pad + width]
+
+def rasterize(paths, size, penwidth=6, gapwidth=6, bgcolor=(0, 0, 0), fgcolor=(255, 255, 255),
+              antialias=1):
+    """Draws (xs, ys) arrays of pixel coordinates in one pass with NumPy.
+
+    Gives the same result as drawing each segment with a background
+    coloured line `gapwidth` wider on each side and then the pen, so
+    later parts of the curve pass over earlier ones.
+    """
+    full = size * antialias
+    pen = penwidth * antialias / 2.0
+    halo = pen + gapwidth * antialias
+    pad = int(halo) + 2
+    stride = full + 2 * pad
+    # How much further along the curve the gap must be to hide the pen.
+    overlap = halo + pen + 2
+    xs_all, ys_all, arcs = [], [], []
+    offset = 0.0
+    for xs, ys in paths:
+        xs = numpy.asarray(xs, dtype=float) * antialias
+        ys = numpy.asarray(ys, dtype=float) * antialias
+        lengths = numpy.hypot(numpy.diff(xs), numpy.diff(ys))
+        keep = numpy.concatenate(([True], lengths > 0))
+        xs, ys = xs[keep], ys[keep]
+        if not len(xs):
+            continue
+        nodes = numpy.concatenate(([0], numpy.cumsum(lengths[lengths > 0])))
+        arc = numpy.append(numpy.arange(0, nodes[-1], 1.0), nodes[-1])
+        xs_all.append(numpy.interp(arc, nodes, xs))
+        ys_all.append(numpy.interp(arc, nodes, ys))
+        arcs.append(arc + offset)
+        offset += nodes[-1] + overlap + 1
+    # Each pixel holds the distance along the curve it was last drawn at.
+    drawn = numpy.empty(stride * stride, dtype=numpy.float32)
+    drawn.fill(-1)
+    if arcs:
+        px = numpy.round(numpy.concatenate(xs_all)).astype(int) + pad
+        py = numpy.round(numpy.concatenate(ys_all)).astype(int) + pad
+        inside = (px >= 0) & (px < stride) & (py >= 0) & (py < stride)
+        drawn[py[inside] * stride + px[inside]] = numpy.concatenate(arcs)[inside]
+    levels = [drawn]
+    while (1 << len(levels)) <= 2 * halo + 1:
+        step = 1 << (len(levels) - 1)
+        levels.append(numpy.maximum(levels[-1][:-step], levels[-1][step:]))
+    inked = _max_filter(levels, pen, pad, (full, full))
+    hidden = _max_filter(levels, halo, pad, (full, full))
+    cover = (inked >= 0) & (hidden - inked <= overlap)
+    if antialias > 1:
+        cover = cover.reshape(size, antialias, size, antialias).mean(axis=3).mean(axis=1)
+        bg = numpy.array(bgcolor, dtype=numpy.float32)
+        fg = numpy.array(fgcolor, dtype=numpy.float32)
+        pixels = (bg + (fg - bg) * cover[:, :, numpy.newaxis] + 0.5).astype(numpy.uint8)
+    else:
+        pixels = numpy.empty((size, size, 3), dtype=numpy.uint8)
+        pixels[...] = bgcolor
+        pixels[cover] = fgcolor
+    return Image.fromarray(pixels, 'RGB')
+
+# Opcodes for the tokens of a genome: the atoms, then OPERATORS in order.
+CIRCLE, LINE, INTEGER, NUMBER, PAIR, FIRST_OPERATOR = range(6)
+OPERATORS = (translate, scale, rotate, reverse, concat, repeat, step, boustro)
+
+# Only the top STACK_WRAP values on the genome stack can be reached by
+# popping past the bottom of it.
+STACK_WRAP = 8
+
+
+def _argcount(func):
+    if inspect.isclass(func):
+        return len(inspect.getargspec(func.__init__)[0]) - 1
+    return len(inspect.getargspec(func)[0])
+
+
+# The number of arguments each operator takes.
+ARITY = dict((op, _argcount(op)) for op in OPERATORS)
+ATOM_TYPES = {PlatonicCircle: CIRCLE, PlatonicLine: LINE, int: INTEGER, long: INTEGER,
+              float: NUMBER, tuple: PAIR}
+OPCODES = dict((op, FIRST_OPERATOR + i) for i, op in enumerate(OPERATORS))
+OPCODE_ARITY = dict((opcode, 0) for opcode in range(FIRST_OPERATOR))
+OPCODE_ARITY.update((OPCODES[op], ARITY[op]) for op in OPERATORS)
+# How many numbers each opcode takes from a Genome's constants.
+OPCODE_CONSTANTS = [0, 0, 1, 1, 2] + [0] * len(OPERATORS)
 
 
 def is_atom(obj):
-    return isinstance(obj, (PlatonicCircle, PlatonicLine, int, float, tuple))
+    return type(obj) in ATOM_TYPES or isinstance(obj, (PlatonicCircle, PlatonicLine, int, float,
+                                                       tuple))
 
 
 def is_operator(obj):
     return (isinstance(obj, Curve) and not is_atom(obj)) or obj == boustro
 
 
-def stackparse(expr, normalize=False):
-    """Parses a stack-based representation of a curve expression, returning the expression tree."""
-    stack = PicStack()
-    for i, token in enumerate(expr):
-        if isinstance(token, (PlatonicCircle, PlatonicLine, int, float, tuple)):
-            stack.push((token, frozenset([i])))
-        elif callable(token):
-            if inspect.isclass(token):
-                argcount = len(inspect.getargspec(token.__init__)[0]) - 1
+def token_arity(token):
+    """Returns how many values a genome token pops: 0 for atoms, or None
+    for tokens that aren't instructions and are skipped."""
+    if is_atom(token):
+        return 0
+    if not callable(token):
+        return None
+    if token not in ARITY:
+        ARITY[token] = _argcount(token)
+    return ARITY[token]
+
+
+def encode(expr):
+    """Converts a genome to a list of opcodes and a list of the numbers in it.
+
+    Numbers and pairs each take one opcode, and one or two numbers.
+    """
+    opcodes = []
+    constants = []
+    for token in expr:
+        kind = ATOM_TYPES.get(type(token))
+        if kind is None:
+            kind = OPCODES[token]
+        elif kind == PAIR:
+            constants.extend(token)
+        elif kind != CIRCLE and kind != LINE:
+            constants.append(token)
+        opcodes.append(kind)
+    return opcodes, constants
+
+
+def decode(opcodes, constants):
+    """Converts the result of `encode` back to a genome."""
+    expr = []
+    values = iter(constants)
+    for kind in opcodes:
+        if kind == CIRCLE:
+            expr.append(circle)
+        elif kind == LINE:
+            expr.append(line)
+        elif kind == INTEGER:
+            expr.append(int(next(values)))
+        elif kind == NUMBER:
+            expr.append(float(next(values)))
+        elif kind == PAIR:
+            expr.append((float(next(values)), float(next(values))))
+        else:
+            expr.append(OPERATORS[kind - FIRST_OPERATOR])
+    return expr
+
+
+class Genome(object):
+    """A genome stored compactly, as an array of opcodes and an array of
+    the numbers they use, in order.
+
+    Can be sliced, added and indexed like the list of tokens it stands
+    for, and `stackparse` and `prune` take it directly.
+    """
+
+    # Starts the string form, which goes on with the number of opcodes,
+    # the opcodes, then the numbers as little-endian doubles.
+    MAGIC = "G1"
+
+    def __init__(self, opcodes=(), constants=()):
+        self.opcodes = array.array('B', opcodes)
+        self.constants = array.array('d', constants)
+
+    @classmethod
+    def from_tokens(cls, expr):
+        return cls(*encode(expr))
+
+    def tokens(self):
+        return decode(self.opcodes, self.constants)
+
+    def constant_index(self, i):
+        """Returns the index in `constants` of the first number for opcode i."""
+        counts = OPCODE_CONSTANTS
+        return sum(counts[opcode] for opcode in itertools.islice(self.opcodes, i))
+
+    def set_atom(self, i, opcode, values, start=None):
+        """Replaces the atom at i with one of type `opcode`, taking `values`.
+
+        `start` is constant_index(i), if the caller already knows it.
+        """
+        if start is None:
+            start = self.constant_index(i)
+        end = start + OPCODE_CONSTANTS[self.opcodes[i]]
+        self.constants[start:end] = array.array('d', values)
+        self.opcodes[i] = opcode
+
+    def keep(self, flags):
+        """Removes the tokens whose flag is False."""
+        opcodes = array.array('B')
+        constants = array.array('d')
+        start = 0
+        for opcode, alive in itertools.izip(self.opcodes, flags):
+            end = start + OPCODE_CONSTANTS[opcode]
+            if alive:
+                opcodes.append(opcode)
+                constants.extend(self.constants[start:end])
+            start = end
+        self.opcodes, self.constants = opcodes, constants
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def __iter__(self):
+        return iter(self.tokens())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, stride = index.indices(len(self))
+            if stride != 1:
+                raise ValueError("Genomes can only be sliced with a step of 1")
+            stop = max(start, stop)
+            return Genome(self.opcodes[start:stop],
+                          self.constants[self.constant_index(start):self.constant_index(stop)])
+        if index < 0:
+            index += len(self)
+        opcode = self.opcodes[index]
+        start = self.constant_index(index)
+        return decode([opcode], self.constants[start:start + OPCODE_CONSTANTS[opcode]])[0]
+
+    def __add__(self, other):
+        return Genome(self.opcodes + other.opcodes, self.constants + other.constants)
+
+    def __eq__(self, other):
+        return (isinstance(other, Genome) and self.opcodes == other.opcodes
+                and self.constants == other.constants)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "Genome(%r)" % (self.tokens(),)
+
+    def tostring(self):
+        constants = self.constants
+        if sys.byteorder == 'big':
+            constants = array.array('d', constants)
+            constants.byteswap()
+        return "".join((self.MAGIC, struct.pack("<I", len(self.opcodes)),
+                        self.opcodes.tostring(), constants.tostring()))
+
+    @classmethod
+    def fromstring(cls, data):
+        start = len(cls.MAGIC) + 4
+        count, = struct.unpack("<I", data[len(cls.MAGIC):start])
+        genome = cls()
+        genome.opcodes.fromstring(data[start:start + count])
+        genome.constants.fromstring(data[start + count:])
+        if sys.byteorder == 'big':
+            genome.constants.byteswap()
+        return genome
+
+
+def _trace(expr, atom_types=ATOM_TYPES, arities=ARITY):
+    """Runs the genome stack machine without evaluating anything.
+
+    Returns a list giving, for each token, the indices of the tokens whose
+    values it pops (-1 for the 0 popped off an empty stack), or None if
+    the token is skipped; and the index of the token whose value is left
+    on top at the end. Popping past the bottom of the stack wraps around
+    to the top STACK_WRAP slots, and pushing overwrites whatever is there.
+
+    With `atom_types` empty and OPCODE_ARITY for `arities`, runs on the
+    opcodes of a Genome instead of tokens.
+    """
+    count = len(expr)
+    sources = [None] * count
+    # The stack only grows, so `size` slots are in use and `top` is where
+    # the next value goes.
+    slots = [0] * count
+    size = top = 0
+    for i in xrange(count):
+        token = expr[i]
+        if type(token) in atom_types:
+            args = ()
+        else:
+            arity = arities.get(token)
+            if arity is None:
+                arity = token_arity(token)
+                if arity is None:
+                    continue
+            if not size:
+                args = (-1,) * arity
+            elif top >= arity:
+                top -= arity
+                args = slots[top:top + arity]
             else:
-                argcount = len(inspect.getargspec(token)[0])
-            args, cliques = zip(*stack.pop(argcount))
-            stack.push((token(*args), frozenset([i]).union(*cliques)))
-    result, clique = stack.pop()[0]
+                args = [0] * arity
+                for k in xrange(arity - 1, -1, -1):
+                    top -= 1
+                    if top < 0:
+                        top = min(size, STACK_WRAP) - 1
+                    args[k] = slots[top]
+        sources[i] = args
+        slots[top] = i
+        top += 1
+        if top > size:
+            size = top
+    if not size:
+        return sources, -1
+    top -= 1
+    if top < 0:
+        top = min(size, STACK_WRAP) - 1
+    return sources, slots[top]
+
+
+def _live(sources, result):
+    """Returns a list of flags marking the tokens the result depends on.
+
+    It has an extra flag at the end, so that the -1 of a value popped off
+    an empty stack can be marked without checking for it.
+    """
+    live = [False] * (len(sources) + 1)
+    live[result] = True
+    for i in xrange(result, -1, -1):
+        if live[i]:
+            for j in sources[i]:
+                live[j] = True
+    return live
+
+
+def _trace_genome(expr):
+    if isinstance(expr, Genome):
+        return _trace(expr.opcodes, (), OPCODE_ARITY)
+    return _trace(expr)
+
+
+def prune(expr):
+    """Returns the tokens of a genome that its curve depends on, in order.
+
+    The last of them, if there are any, is the one that makes the curve.
+    Given a Genome, returns a new Genome.
+    """
+    sources, result = _trace_genome(expr)
+    live = _live(sources, result) if result >= 0 else [False] * len(expr)
+    if isinstance(expr, Genome):
+        pruned = Genome(expr.opcodes, expr.constants)
+        pruned.keep(live)
+        return pruned
+    return [token for token, alive in itertools.izip(expr, live) if alive]
+
+
+def depth(expr):
+    """Returns the depth of the tree that stackparse would build from a
+    genome, counting an atom as 1, without building it."""
+    sources, result = _trace_genome(expr)
+    if result < 0:
+        return 0
+    # The last depth is for the 0 popped off an empty stack.
+    depths = [0] * len(sources) + [1]
+    for i in xrange(result + 1):
+        if sources[i] is not None:
+            depths[i] = 1 + max([depths[j] for j in sources[i]] or [0])
+    return depths[result]
+
+
+def stackparse(expr, normalize=False):
+    """Parses a stack-based representation of a curve expression, returning the expression tree.
+
+    With `normalize`, also removes the tokens the curve doesn't depend on
+    from `expr`. Only those tokens are evaluated. `expr` can be a list of
+    tokens or a Genome.
+    """
+    sources, result = _trace_genome(expr)
+    genome = None
+    if isinstance(expr, Genome):
+        genome, expr = expr, expr.tokens()
+    if result < 0:
+        if normalize and genome is not None:
+            genome.keep([])
+        elif normalize:
+            del expr[:]
+        return 0
+    live = _live(sources, result)
+    # The last value is the 0 popped off an empty stack.
+    values = [0] * (len(expr) + 1)
+    for i in xrange(result + 1):
+        if not live[i]:
+            continue
+        token = expr[i]
+        args = sources[i]
+        if args:
+            values[i] = token(*[values[j] for j in args])
+        elif type(token) in ATOM_TYPES or is_atom(token):
+            values[i] = token
+        else:
+            values[i] = token()
     if normalize:
-        expr[:] = [token for i, token in enumerate(expr) if i in clique]
-    return result
+        if genome is not None:
+            genome.keep(live)
+        else:
+            expr[:] = [token for token, alive in itertools.izip(expr, live) if alive]
+    return values[result]
 
 
 repl_doc = """
@@ -0,0 +1,99 @@
+"""Live Elo ratings for the individuals in a generation.
+
+Each vote moves the winner's rating up and the loser's down by the same
+amount, depending on how surprising the result was. Ratings live in
+memcache, stored as integer hundredths of a point so that updates can use
+memcache's atomic offsets, and are checkpointed to the datastore every
+CHECKPOINT_INTERVAL votes so they survive eviction.
+"""
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext.deferred import defer
+from google.appengine.ext import ndb
+
+import model
+
+INITIAL_RATING = 1500.0
+K_FACTOR = 32.0
+CHECKPOINT_INTERVAL = 50
+# Ratings are stored in memcache as integers of this many points.
+RESOLUTION = 0.01
+
+
+class RatingCheckpoint(ndb.Model):
+    """The ratings for a generation as a dict of individual id to rating."""
+    ratings = ndb.PickleProperty(compressed=True)
+    num_votes = ndb.IntegerProperty(default=0)
+
+
+def _prefix(generation):
+    return "rating/%d/" % (generation,)
+
+
+def expected_score(rating, opponent):
+    """Returns the chance that an individual with `rating` beats `opponent`."""
+    return 1.0 / (1 + 10 ** ((opponent - rating) / 400.0))
+
+
+def get_ratings(generation, ids):
+    """Returns a dict mapping each of the individual ids to its rating."""
+    prefix = _prefix(generation)
+    keys = [str(id) for id in ids]
+    values = memcache.get_multi(keys, key_prefix=prefix)
+    missing = [key for key in keys if key not in values]
+    if missing:
+        checkpoint = RatingCheckpoint.get_by_id(generation)
+        saved = checkpoint.ratings if checkpoint else {}
+        restored = dict((key, int(round(saved.get(int(key), INITIAL_RATING) / RESOLUTION)))
+                        for key in missing)
+        memcache.add_multi(restored, key_prefix=prefix)
+        values.update(memcache.get_multi(missing, key_prefix=prefix))
+        for key in missing:
+            values.setdefault(key, restored[key])
+    return dict((int(key), value * RESOLUTION) for key, value in values.items())
+
+
+def record(generation, winner, loser):
+    """Updates the ratings of two individuals after a vote between them."""
+    ratings = get_ratings(generation, [winner, loser])
+    change = K_FACTOR * (1 - expected_score(ratings[winner], ratings[loser]))
+    change = int(round(change / RESOLUTION))
+    memcache.offset_multi({str(winner): change, str(loser): -change},
+                          key_prefix=_prefix(generation))
+    num_votes = memcache.incr(_prefix(generation) + "votes", initial_value=0)
+    if num_votes and num_votes % CHECKPOINT_INTERVAL == 0:
+        try:
+            defer(checkpoint, generation,
+                  _name="rating-checkpoint-%d-%d" % (generation, num_votes))
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            pass
+
+
+def checkpoint(generation):
+    """Saves the current ratings of a generation to the datastore."""
+    keys = model.Individual.query(model.Individual.generation == generation).fetch(keys_only=True)
+    ratings = get_ratings(generation, [key.id() for key in keys])
+    num_votes = memcache.get(_prefix(generation) + "votes") or 0
+    RatingCheckpoint(id=generation, ratings=ratings, num_votes=num_votes).put()
+    return ratings
+
+
+def has_ratings(generation):
+    """Returns True if any votes have been rated for a generation."""
+    return bool(memcache.get(_prefix(generation) + "votes")
+                or RatingCheckpoint.get_by_id(generation))
+
+
+def ranked(generation, ids):
+    """Returns the ids sorted from highest to lowest rating."""
+    ratings = get_ratings(generation, ids)
+    return sorted(ids, key=lambda id: ratings[id], reverse=True)
+
+
+def strengths(ratings):
+    """Converts Elo ratings to Bradley-Terry strengths that sum to 1."""
+    weights = dict((id, 10 ** ((rating - INITIAL_RATING) / 400.0))
+                   for id, rating in ratings.items())
+    total = sum(weights.values())
+    return dict((id, weight / total) for id, weight in weights.items())
@@ -0,0 +1,81 @@
+"""Caches rendered images by the curve they show.
+
+Crossbreeding often produces a child whose genome, once dead code has been
+pruned, describes a curve that has already been rendered. The cache maps
+`piclang.fingerprint` of the pruned curve to the stored images, so such a
+child can share them instead of rendering and uploading its own.
+
+Lookups go to a small in-memory LRU first, then to the datastore.
+"""
+
+import collections
+import threading
+
+
+class LRUCache(object):
+    """A dict holding at most `capacity` items, dropping the least recently used."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.pop(key, None)
+            if value is not None:
+                self._items[key] = value
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class RenderCache(object):
+    """Looks up entities of `model_class`, keyed by curve fingerprint."""
+
+    def __init__(self, model_class, capacity=1000):
+        self.model_class = model_class
+        self.local = LRUCache(capacity)
+        self.local_hits = 0
+        self.datastore_hits = 0
+        self.misses = 0
+
+    def get(self, fingerprint):
+        """Returns the entity stored for `fingerprint`, or None."""
+        entity = self.local.get(fingerprint)
+        if entity is not None:
+            self.local_hits += 1
+            return entity
+        entity = self.model_class.get_by_id(fingerprint)
+        if entity is not None:
+            self.datastore_hits += 1
+            self.local.put(fingerprint, entity)
+            return entity
+        self.misses += 1
+        return None
+
+    def put(self, fingerprint, store=True, **kwargs):
+        """Caches a new entity for `fingerprint` and returns it, writing it
+        to the datastore unless `store` is False, in which case the caller
+        has to."""
+        entity = self.model_class(id=fingerprint, **kwargs)
+        if store:
+            entity.put()
+        self.local.put(fingerprint, entity)
+        return entity
+
+    def stats(self):
+        return {
+            'local_hits': self.local_hits,
+            'datastore_hits': self.datastore_hits,
+            'misses': self.misses,
+            'size': len(self.local),
+        }
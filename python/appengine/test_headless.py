@@ -0,0 +1,22 @@
+import unittest
+
+import gen0
+import headless
+
+
+def nothing(curve):
+    return 0.0
+
+
+class EngineTest(unittest.TestCase):
+    def test_step_when_nothing_scores(self):
+        engine = headless.Engine(nothing, size=5)
+        engine.seed(gen0.gen0_genomes)
+        engine.step()
+        self.assertEqual(engine.generation, 1)
+        self.assertEqual(len(engine.genomes), 5)
+        self.assertEqual(engine.scores, [0.0] * 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#! /usr/bin/env python
+"""Times the different ways of evaluating the piclang example curves.
+
+The examples in the REPL documentation are the same curves as the gen0
+genomes in the app engine app. `benchmark.py clip [points]` times the ways
+of clipping a path to the table instead, and `benchmark.py draw [points]`
+the ways of drawing the examples as the app does.
+"""
+
+import math
+import sys
+import timeit
+
+import paths
+import piclang
+from piclang import Curve, share
+
+
+def examples():
+    """Returns the example formulas from the REPL documentation."""
+    formulas = []
+    for text in piclang.repl_doc.splitlines():
+        try:
+            f = eval(text, vars(piclang))
+        except SyntaxError:
+            continue
+        if isinstance(f, Curve):
+            formulas.append((text, f))
+    return formulas
+
+
+def per_sample(func, points):
+    """Returns the best time taken by func, in microseconds per sample."""
+    return min(timeit.repeat(func, number=1, repeat=3)) / points * 1e6
+
+
+def clip_loop(curve, radius):
+    """Clips a list of points one at a time, as curveplotter used to."""
+    curve = list(curve)
+    for i in range(len(curve)):
+        distance = math.sqrt(curve[i][0] * curve[i][0] + curve[i][1] * curve[i][1]) / radius
+        if distance > 1.0:
+            curve[i] = (curve[i][0] / distance, curve[i][1] / distance)
+    return curve
+
+
+def clip_main(args):
+    numpy = piclang.numpy
+    points = int(args[0]) if args else 10 ** 6
+    radius = 5000
+    # A curve that spends about a third of its time off the table.
+    xs, ys = piclang.interpolate_array((piclang.circle + piclang.circle ** 7 * 0.4) * radius, points)
+    curve = zip(xs.tolist(), ys.tolist())
+    chunks = [(xs[i:i + piclang.STREAM_CHUNK], ys[i:i + piclang.STREAM_CHUNK])
+              for i in range(0, points, piclang.STREAM_CHUNK)]
+
+    print "Microseconds per point, %d points" % (points,)
+    for name, func in (
+            ("loop", lambda: clip_loop(curve, radius)),
+            ("iter_clip", lambda: list(paths.iter_clip(curve, radius))),
+            ("clip_array", lambda: paths.clip_array(xs, ys, radius)),
+            ("cut_array", lambda: paths.cut_array(xs, ys, radius)),
+            ("iter_cut", lambda: list(paths.iter_cut(chunks, radius)))):
+        print "%-12s %8.3f" % (name, per_sample(func, points))
+
+
+def draw_main(args):
+    points = int(args[0]) if args else 8192
+    sizes = (800, 64, 128, 512)
+    # Drawing with PIL, rasterize, or whichever is quicker for each size.
+    choices = (("pil", 0), ("rasterize", float('inf')), ("render", piclang.RASTERIZE_PIXELS_PER_POINT))
+
+    print "Milliseconds to draw at sizes %s, up to %d points" % (sizes, points)
+    print "%-60s %8s %10s %10s %10s" % (("formula", "points") + tuple(name for name, ratio in choices))
+    for formula, f in examples():
+        count = sum(len(xs) for xs, ys in piclang.interpolate_segments(f, points, 0.5, (800, 800)))
+        times = []
+        for name, ratio in choices:
+            piclang.RASTERIZE_PIXELS_PER_POINT = ratio
+            times.append(min(timeit.repeat(
+                lambda: piclang.render(f, points, sizes, tolerance=0.5), number=1, repeat=3)) * 1000)
+        piclang.RASTERIZE_PIXELS_PER_POINT = choices[-1][1]
+        print "%-60s %8d %10.1f %10.1f %10.1f" % ((formula[:60], count) + tuple(times))
+
+
+def main(args):
+    if args and args[0] == 'clip':
+        return clip_main(args[1:])
+    if args and args[0] == 'draw':
+        return draw_main(args[1:])
+    points = int(args[0]) if args else 4000
+    ts = [x / float(points) for x in range(points)]
+    if piclang.numpy is not None:
+        ts_array = piclang.numpy.array(ts)
+
+    print "Microseconds per sample, %d samples" % (points,)
+    print "%-60s %8s %8s %8s %8s" % ("formula", "tree", "compiled", "numpy", "shared")
+    for formula, f in examples():
+        compiled = f.compile().func
+        shared = share(f)
+        tree_time = per_sample(lambda: [f(t) for t in ts], points)
+        compiled_time = per_sample(lambda: [compiled(t) for t in ts], points)
+        if piclang.numpy is not None:
+            numpy_time = per_sample(lambda: f.evaluate(ts_array.copy()), points)
+            shared_time = per_sample(lambda: shared.evaluate(ts_array.copy()), points)
+        else:
+            numpy_time = shared_time = float('nan')
+        print "%-60s %8.2f %8.2f %8.2f %8.2f" % (
+            formula[:60], tree_time, compiled_time, numpy_time, shared_time)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
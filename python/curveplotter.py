@@ -1,6 +1,10 @@
 from piclang import *
+import piclang
+import estimate
+import itertools
 import logging
 import json
+import paths
 import serial
 import sandplotter
 import time
@@ -9,41 +13,122 @@ import urllib
 ser = None
 p = None
 
+# Curves predicted to take longer than this many seconds are skipped.
+MAX_PLOT_TIME = 60 * 60
+# Step interval to plot curves at.
+PLOT_SPEED = 2000
+# Radius in steps that the unit circle is scaled to.
+CURVE_RADIUS = 5000
 
-def init_plotter():
+
+def init_plotter(background=False):
+  """Connects to the plotter. With `background`, commands run in a thread
+  of their own; see sandplotter.BackgroundPlotter."""
   global ser, p
   if ser:
     ser.close()
   ser = serial.Serial('/dev/tty.SandPlotter-DevB', 38400)
-  p = sandplotter.SandPlotter(ser)
+  if background:
+    p = sandplotter.BackgroundPlotter(ser)
+  else:
+    p = sandplotter.SandPlotter(ser)
   return p
 
 
-def plot_curve(f, points=1000):
-  curve = interpolate(f * 5000, points)
-  for i in range(len(curve)):
-    radius = math.sqrt(curve[i][0] * curve[i][0] + curve[i][1] * curve[i][1]) / 5000.0
-    if radius > 1.0:
-      curve[i] = (curve[i][0] / radius, curve[i][1] / radius)
-  p.plot(curve)
+def curve_segments(f, points=1000, tolerance=1.0,
+                   steps_per_circle=estimate.STEPS_PER_CIRCLE, max_radius=estimate.MAX_RADIUS):
+  """Samples a curve to within `tolerance` steps using at most `points` points.
+
+  Returns a list of continuous segments, clipped to the table, without the
+  points the plotter can't tell apart from a straight line.
+  """
+  segments = []
+  simplify_tolerance = paths.plotter_tolerance(steps_per_circle, max_radius)
+  for xs, ys in interpolate_segments(f * CURVE_RADIUS, points, tolerance):
+    segments.append(paths.simplify(paths.iter_cut([(xs, ys)], CURVE_RADIUS), simplify_tolerance))
+  return segments
+
+def stream_segments(f, points=1000, tolerance=None,
+                    steps_per_circle=estimate.STEPS_PER_CIRCLE, max_radius=estimate.MAX_RADIUS,
+                    radius=CURVE_RADIUS):
+  """Like curve_segments, but lazily: returns an iterator of segments, each
+  an iterator of points, that works out each point as it's needed.
+
+  Samples `points` evenly spaced points, refined to within `tolerance`
+  steps if it is given, with the unit circle scaled to `radius` steps and
+  anything outside it cut off. Each segment must be used up before the
+  next.
+  """
+  simplify_tolerance = paths.plotter_tolerance(steps_per_circle, max_radius)
+  for chunks in piclang.stream_chunks(f * radius, points, tolerance):
+    yield paths.iter_simplify(paths.iter_cut(chunks, radius), simplify_tolerance)
+
+def plot_segments(plotter, segments):
+  """Plots segments, sending them as moves in the table's own polar steps."""
+  simplify_tolerance = paths.plotter_tolerance(plotter.steps_per_circle, plotter.max_radius)
+  for segment in segments:
+    plotter.travel(*segment[0])
+    plotter.plot_polar(paths.plan_polar(
+        segment, plotter.steps_per_circle, simplify_tolerance, plotter.theta_steps))
+
+def plot_stream(plotter, segments):
+  """Like plot_segments, but for segments that are iterators, sending each
+  move as soon as it has been worked out."""
+  simplify_tolerance = paths.plotter_tolerance(plotter.steps_per_circle, plotter.max_radius)
+  for segment in segments:
+    segment = iter(segment)
+    first = next(segment, None)
+    if first is None:
+      continue
+    plotter.travel(*first)
+    plotter.plot_polar(paths.iter_polar(itertools.chain([first], segment),
+        plotter.steps_per_circle, simplify_tolerance, plotter.theta_steps))
+
+def plot_curve(f, points=1000, tolerance=1.0):
+  """Plots a curve from `points` evenly spaced samples, refined to within
+  `tolerance` steps, starting before the rest of the curve is worked out."""
+  plot_stream(p, stream_segments(f, points, tolerance, p.steps_per_circle, p.max_radius))
+
+def next_curve(interval, steps_per_circle=estimate.STEPS_PER_CIRCLE, max_radius=estimate.MAX_RADIUS):
+  """Fetches a random curve from the app and returns its segments, skipping
+  any that would take too long to plot."""
+  while True:
+    data = json.loads(urllib.urlopen("http://sandplotter.appspot.com/random").read())
+    logging.warn(data)
+    curve = eval(data['formula']).compile()
+    segments = curve_segments(curve, data['points'], 1.0, steps_per_circle, max_radius)
+    duration, segment_times = estimate.plot_time(segments, interval, steps_per_circle, max_radius)
+    if duration <= MAX_PLOT_TIME:
+      break
+    logging.warn("Skipping curve that would take %.0f minutes", duration / 60)
+  logging.info("Next curve has %d segments, expected to take %.0f minutes", len(segments), duration / 60)
+  return segments
+
+def random_curve(interval=PLOT_SPEED):
+  """Plots a random curve from the app."""
+  plot_segments(p, next_curve(interval, p.steps_per_circle, p.max_radius))
 
-def random_curve():
-  data = json.loads(urllib.urlopen("http://sandplotter.appspot.com/random").read())
-  logging.warn(data)
-  curve = eval(data['formula'])
-  plot_curve(curve, data['points'])
+def erase(plotter):
+  """Spirals out from the centre to smooth the sand over."""
+  plotter.set_speed(400)
+  plotter.move_xy(-5000, 0)
+  plotter.move_polar(-5000, math.pi * 40)
+  plotter.zero()
 
 def main():
-  init_plotter()
+  init_plotter(background=True)
   p.set_speed(400)
   p.zero()
+  segments = next_curve(PLOT_SPEED, p.plotter.steps_per_circle, p.plotter.max_radius)
   while True:
-    p.set_speed(400)
-    p.move_xy(-5000, 0)
-    p.move_polar(-5000, math.pi * 40)
-    p.zero()
-    p.set_speed(2000)
-    random_curve()
+    p.run(erase)
+    p.set_speed(PLOT_SPEED)
+    p.run(plot_segments, segments)
+    # Work out the next curve while this one is drawn.
+    segments = next_curve(PLOT_SPEED, p.plotter.steps_per_circle, p.plotter.max_radius)
+    p.wait()
+    while not p.logs.empty():
+      logging.debug("LOG %s", p.logs.get())
     time.sleep(30)
 
 if __name__ == '__main__':
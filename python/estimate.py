@@ -0,0 +1,136 @@
+#! /usr/bin/env python
+"""Predicts how long the plotter will take to draw something.
+
+Follows the firmware's timing: once `set_speed(interval)` has been called,
+the motors step at most once every `interval` microseconds, with no
+acceleration ramp. For `m` moves the firmware walks the line a step at a
+time and works out the rotor and arm positions for each point with float
+maths, which on the AVR can take longer than a step interval. For `r`
+moves it only counts steps.
+"""
+
+import math
+import sys
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import paths
+
+STEPS_PER_CIRCLE = 25600
+MAX_RADIUS = 5500
+# Microseconds the AVR takes to work out the next point of an `m` move.
+MOVE_XY_COMPUTE_US = 300
+# Microseconds to read, parse and set up any command.
+COMMAND_OVERHEAD_US = 1000
+
+
+class MotionModel(object):
+    """Tracks the firmware's position through a series of moves, adding up
+    how long each one takes."""
+
+    def __init__(self, interval=1000, steps_per_circle=STEPS_PER_CIRCLE):
+        self.interval = interval
+        self.steps_per_circle = steps_per_circle
+        self.x = self.y = 0
+        self.r = self.theta = 0
+        self.elapsed = 0.0
+
+    def _xy_step_counts(self, x, y):
+        """Returns the steps needed for each point the firmware goes through
+        on the way to x, y, and the arm and rotor positions at the end."""
+        dx, dy = x - self.x, y - self.y
+        distance = math.sqrt(dx * dx + dy * dy)
+        if distance == 0:
+            return [0], self.r, self.theta
+        count = int(distance) + 1
+        rads_to_steps = self.steps_per_circle / (2 * math.pi)
+        if numpy is not None:
+            i = numpy.arange(1, count + 1)
+            fx = self.x + i * (dx / distance)
+            fy = self.y + i * (dy / distance)
+            rs = numpy.sqrt(fx * fx + fy * fy).astype(int)
+            thetas = ((numpy.arctan2(fy, fx) + math.pi) * rads_to_steps).astype(int)
+            # Near the centre the firmware leaves the rotor where it is.
+            last_outer = numpy.where(rs >= paths.CENTER_THRESHOLD, i - 1, -1)
+            last_outer = numpy.maximum.accumulate(last_outer)
+            thetas = numpy.where(last_outer >= 0, thetas[last_outer], self.theta)
+            dr = numpy.abs(numpy.diff(numpy.concatenate(([self.r], rs))))
+            dtheta = numpy.abs(numpy.diff(numpy.concatenate(([self.theta], thetas))))
+            dtheta = numpy.minimum(dtheta, self.steps_per_circle - dtheta)
+            return numpy.maximum(dr, dtheta).tolist(), int(rs[-1]), int(thetas[-1])
+        counts = []
+        r, theta = self.r, self.theta
+        for i in range(1, count + 1):
+            fx = self.x + i * (dx / distance)
+            fy = self.y + i * (dy / distance)
+            target_r = int(math.sqrt(fx * fx + fy * fy))
+            target_theta = theta
+            if target_r >= paths.CENTER_THRESHOLD:
+                target_theta = int((math.atan2(fy, fx) + math.pi) * rads_to_steps)
+            dtheta = abs(target_theta - theta)
+            counts.append(max(abs(target_r - r), min(dtheta, self.steps_per_circle - dtheta)))
+            r, theta = target_r, target_theta
+        return counts, r, theta
+
+    def move_xy(self, x, y):
+        """Returns the seconds an `m x y` command takes, and does the move."""
+        x, y = int(x), int(y)
+        counts, self.r, self.theta = self._xy_step_counts(x, y)
+        # One tick per point, which does the maths, plus one for each step
+        # after the first that it takes to get there.
+        first_tick = max(self.interval, MOVE_XY_COMPUTE_US)
+        ticks = sum(max(count, 1) - 1 for count in counts)
+        seconds = (COMMAND_OVERHEAD_US + len(counts) * first_tick + ticks * self.interval) / 1e6
+        self.x, self.y = x, y
+        self.elapsed += seconds
+        return seconds
+
+    def move_steps(self, dr, dtheta):
+        """Returns the seconds an `r dr dtheta` command takes, and does the move."""
+        seconds = (COMMAND_OVERHEAD_US + max(abs(dr), abs(dtheta)) * self.interval) / 1e6
+        self.r += dr
+        self.theta = (self.theta + dtheta) % self.steps_per_circle
+        self.x, self.y = [int(v) for v in paths.from_polar(self.r, self.theta, self.steps_per_circle)]
+        self.elapsed += seconds
+        return seconds
+
+
+def plot_time(segments, interval, steps_per_circle=STEPS_PER_CIRCLE, max_radius=MAX_RADIUS, model=None):
+    """Predicts how long `curveplotter` takes to plot a list of segments.
+
+    Each segment is travelled to with an `m` move, then drawn with the `r`
+    moves `paths.plan_polar` gives for it. Returns the total seconds and a
+    list of the seconds for each segment.
+    """
+    if model is None:
+        model = MotionModel(interval, steps_per_circle)
+    tolerance = paths.plotter_tolerance(steps_per_circle, max_radius)
+    times = []
+    for segment in segments:
+        seconds = model.move_xy(*segment[0])
+        theta = model.theta
+        for radius, target in paths.plan_polar(segment, steps_per_circle, tolerance, model.theta):
+            if radius != model.r or target != theta:
+                seconds += model.move_steps(radius - model.r, target - theta)
+            theta = target
+        times.append(seconds)
+    return sum(times), times
+
+
+def main(args):
+    import curveplotter
+    import piclang
+    formula = args[0]
+    points = int(args[1]) if len(args) > 1 else 1000
+    interval = int(args[2]) if len(args) > 2 else 2000
+    segments = curveplotter.curve_segments(eval(formula, vars(piclang)), points)
+    total, times = plot_time(segments, interval)
+    print "%d segments, %.1f minutes" % (len(segments), total / 60)
+    for i, seconds in enumerate(times):
+        print "  %4d: %.1fs" % (i, seconds)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
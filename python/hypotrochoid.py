@@ -1,28 +1,28 @@
 #! /usr/bin/env python
 
 import logging
-import math
 import sys
 import serial
 import time
 
+import curveplotter
+import parametric
 import sandplotter
 
 
 logging.basicConfig(level=logging.DEBUG)
 
 
+def hypotrochoid_curve(p, q):
+    """Returns the curve drawn by this script: a circle of radius p/q
+    rolling around a unit circle, with the pen on its rim."""
+    return parametric.epitrochoid(q, p, -p)
+
+
 def generate_hypotrochoid(p, q, radius, steps_per_rad=10):
-    a = 1.0
-    b = float(p) / q
-    period = 2 * math.pi * p
-    scale = radius / (a + 2 * b)
-    
-    for i in range(1, int(period * steps_per_rad) + 1):
-        t = float(i) / steps_per_rad
-        x = (a + b) * math.cos(t) + b * math.cos((a + b) / b * t)
-        y = (a + b) * math.sin(t) + b * math.sin((a + b) / b * t)
-        yield x * scale, y * scale
+    """Returns arrays (xs, ys) of points in steps, going round once."""
+    curve = hypotrochoid_curve(p, q)
+    return parametric.sample(curve, parametric.points_for(curve, steps_per_rad), radius)
 
 
 def main(args):
@@ -36,11 +36,16 @@ def main(args):
     socket = serial.Serial(port, baud)
     time.sleep(1.0) # Give the bootloader a chance to exit
 
-    plotter = sandplotter.SandPlotter(socket, debug=True)
+    plotter = sandplotter.SandPlotter(socket)
+    if radius > plotter.max_radius:
+        raise ValueError("Radius %d is beyond the table's %d" % (radius, plotter.max_radius))
     plotter.set_speed(speed)
-    
-    for x, y in generate_hypotrochoid(p, q, radius):
-        plotter.move_xy(int(x), int(y))
+
+    curve = hypotrochoid_curve(p, q)
+    points = parametric.points_for(curve, 10)
+    segments = curveplotter.stream_segments(
+        curve, points, None, plotter.steps_per_circle, plotter.max_radius, radius)
+    curveplotter.plot_stream(plotter, segments)
 
 
 if __name__ == '__main__':
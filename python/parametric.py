@@ -0,0 +1,155 @@
+"""Closed-form curves, evaluated a whole array at a time.
+
+Each curve is a piclang Curve, so it can be combined with the piclang
+operations and plotted through `curveplotter.stream_segments` like any
+other. t runs from 0 to 1 over exactly one period, which is worked out
+from the curve's whole-number parameters, so a closed curve is traced
+once. Every curve fits inside the unit circle; `sample` scales one up to
+plotter steps.
+"""
+
+import fractions
+import math
+
+import piclang
+
+
+class Parametric(piclang.Curve):
+    """A curve given by x and y as functions of an angle.
+
+    Subclasses define `period`, the angle over which the curve closes, and
+    `position(angle, lib)`, which works with `lib` as either `math` or
+    `numpy`, so the same formula serves for single points and arrays.
+    """
+
+    def __call__(self, t):
+        return self.position(t * self.period, math)
+
+    def evaluate(self, ts):
+        return self.position(ts * self.period, piclang.numpy)
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join(repr(arg) for arg in self.args))
+
+
+class hypotrochoid(Parametric):
+    """Traced by a point `d` from the centre of a circle of radius `r`
+    rolling around the inside of one of radius `R`."""
+
+    def __init__(self, R, r, d):
+        self.R, self.r, self.d = R, r, d
+
+    @property
+    def args(self):
+        return self.R, self.r, self.d
+
+    @property
+    def period(self):
+        return 2 * math.pi * self.r / fractions.gcd(self.R, self.r)
+
+    def position(self, angle, lib):
+        k = self.R - self.r
+        size = float(abs(k) + abs(self.d))
+        x = k * lib.cos(angle) + self.d * lib.cos(k * angle / self.r)
+        y = k * lib.sin(angle) - self.d * lib.sin(k * angle / self.r)
+        return x / size, y / size
+
+
+class epitrochoid(Parametric):
+    """Traced by a point `d` from the centre of a circle of radius `r`
+    rolling around the outside of one of radius `R`."""
+
+    def __init__(self, R, r, d):
+        self.R, self.r, self.d = R, r, d
+
+    @property
+    def args(self):
+        return self.R, self.r, self.d
+
+    @property
+    def period(self):
+        return 2 * math.pi * self.r / fractions.gcd(self.R, self.r)
+
+    def position(self, angle, lib):
+        k = self.R + self.r
+        size = float(abs(k) + abs(self.d))
+        x = k * lib.cos(angle) - self.d * lib.cos(k * angle / self.r)
+        y = k * lib.sin(angle) - self.d * lib.sin(k * angle / self.r)
+        return x / size, y / size
+
+
+class rose(Parametric):
+    """The rose r = cos(p/q angle)."""
+
+    def __init__(self, p, q=1):
+        divisor = fractions.gcd(p, q)
+        self.p, self.q = p // divisor, q // divisor
+
+    @property
+    def args(self):
+        return self.p, self.q
+
+    @property
+    def period(self):
+        # With p and q both odd the second half retraces the first.
+        if self.p % 2 and self.q % 2:
+            return math.pi * self.q
+        return 2 * math.pi * self.q
+
+    def position(self, angle, lib):
+        radius = lib.cos(self.p * angle / float(self.q))
+        return radius * lib.cos(angle), radius * lib.sin(angle)
+
+
+class lissajous(Parametric):
+    """x = sin(a angle + phase), y = sin(b angle)."""
+
+    def __init__(self, a, b, phase=math.pi / 2):
+        self.a, self.b, self.phase = a, b, phase
+
+    @property
+    def args(self):
+        return self.a, self.b, self.phase
+
+    @property
+    def period(self):
+        return 2 * math.pi / fractions.gcd(self.a, self.b)
+
+    def position(self, angle, lib):
+        # Shrunk so that the corners of the square fit in the circle.
+        size = math.sqrt(2)
+        return lib.sin(self.a * angle + self.phase) / size, lib.sin(self.b * angle) / size
+
+
+class spiral(Parametric):
+    """An Archimedean spiral out from the centre, making `turns` turns."""
+
+    def __init__(self, turns):
+        self.turns = turns
+
+    @property
+    def args(self):
+        return (self.turns,)
+
+    @property
+    def period(self):
+        return 2 * math.pi * self.turns
+
+    def position(self, angle, lib):
+        radius = angle / self.period
+        return radius * lib.cos(angle), radius * lib.sin(angle)
+
+
+def points_for(curve, steps_per_rad):
+    """Returns how many samples give `steps_per_rad` samples per radian of
+    the curve's angle."""
+    return max(2, int(curve.period * steps_per_rad))
+
+
+def sample(curve, points, radius):
+    """Returns arrays (xs, ys) of `points` evenly spaced samples of a
+    curve, scaled so the unit circle has the given radius in steps."""
+    ts = piclang.numpy.arange(points) / float(points)
+    xs, ys = piclang.evaluate_array(curve, ts)
+    return xs * radius, ys * radius
+
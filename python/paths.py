@@ -0,0 +1,300 @@
+"""Tidies up paths before they are sent to the plotter.
+
+Positions are in plotter steps: the units of `SandPlotter.move_xy`, where
+the radius runs from 0 to `max_radius`. The functions named iter_* are
+generators that take any iterable, so they can be chained to handle paths
+too long to hold in memory. The *_array functions work on numpy arrays.
+"""
+
+import math
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def plotter_tolerance(steps_per_circle, max_radius):
+    """Returns how far a path can be moved without it showing.
+
+    That's the distance the rotor moves the ball in one step at the edge of
+    the table, where its steps are coarsest, or one radial step if that is
+    larger.
+    """
+    return max(1.0, 2 * math.pi * max_radius / steps_per_circle)
+
+
+def iter_clip(points, radius):
+    """Moves points further than `radius` from the centre in onto the circle."""
+    for x, y in points:
+        distance = math.hypot(x, y)
+        if distance > radius:
+            x, y = x * radius / distance, y * radius / distance
+        yield x, y
+
+
+def clip_array(xs, ys, radius):
+    """Like iter_clip, for arrays of coordinates. Returns arrays (xs, ys)."""
+    distance = numpy.hypot(xs, ys)
+    scale = radius / numpy.maximum(distance, radius)
+    return xs * scale, ys * scale
+
+
+def cut_array(xs, ys, radius, previous=None):
+    """Like clip_array, but first adds a point wherever the path crosses the
+    circle, so that a segment leaving the table is cut where it leaves
+    rather than ending at its far end pulled in.
+
+    `previous` is the point before the first one, if the path started in
+    an earlier array; it isn't returned.
+    """
+    if previous is not None:
+        xs = numpy.concatenate(([previous[0]], xs))
+        ys = numpy.concatenate(([previous[1]], ys))
+    ax, ay = xs[:-1], ys[:-1]
+    dx, dy = numpy.diff(xs), numpy.diff(ys)
+    # Solve |a + u d| = radius for u, the fraction of the way along each segment.
+    a = dx * dx + dy * dy
+    b = 2 * (ax * dx + ay * dy)
+    c = ax * ax + ay * ay - radius * radius
+    discriminant = b * b - 4 * a * c
+    crosses = (a > 0) & (discriminant > 0)
+    root = numpy.sqrt(numpy.where(crosses, discriminant, 0))
+    a = numpy.where(crosses, a, 1)
+    segments, fractions = [], []
+    for u in ((-b - root) / (2 * a), (-b + root) / (2 * a)):
+        index = numpy.flatnonzero(crosses & (u > 0) & (u < 1))
+        segments.append(index)
+        fractions.append(u[index])
+    segments = numpy.concatenate(segments)
+    fractions = numpy.concatenate(fractions)
+    order = numpy.argsort(segments + fractions)
+    segments, fractions = segments[order], fractions[order]
+    xs = numpy.insert(xs, segments + 1, ax[segments] + fractions * dx[segments])
+    ys = numpy.insert(ys, segments + 1, ay[segments] + fractions * dy[segments])
+    if previous is not None:
+        xs, ys = xs[1:], ys[1:]
+    return clip_array(xs, ys, radius)
+
+
+def iter_cut(chunks, radius):
+    """Yields the points of a path given as (xs, ys) arrays, cut and clipped
+    to the circle by cut_array. Without numpy, clips them as iter_clip does."""
+    previous = None
+    for xs, ys in chunks:
+        if numpy is None:
+            for point in iter_clip(zip(xs, ys), radius):
+                yield point
+            continue
+        if not len(xs):
+            continue
+        last = (xs[-1], ys[-1])
+        xs, ys = cut_array(numpy.asarray(xs, float), numpy.asarray(ys, float), radius, previous)
+        previous = last
+        for point in zip(xs.tolist(), ys.tolist()):
+            yield point
+
+
+def dedupe(points):
+    """Rounds points to whole steps and drops any that repeat the one before."""
+    result = []
+    for x, y in points:
+        point = (int(round(x)), int(round(y)))
+        if not result or point != result[-1]:
+            result.append(point)
+    return result
+
+
+def _chord_distances(xs, ys, first, last):
+    """Returns the distances of the points between first and last from the
+    segment joining them. Unlike the line through them, that doesn't pass
+    close to points where the path doubles back beyond either end."""
+    ax, ay = xs[first], ys[first]
+    dx, dy = xs[last] - ax, ys[last] - ay
+    length = float(dx * dx + dy * dy)
+    distances = []
+    for i in range(first + 1, last):
+        px, py = xs[i] - ax, ys[i] - ay
+        u = min(max((px * dx + py * dy) / length, 0), 1) if length else 0
+        distances.append(math.hypot(px - u * dx, py - u * dy))
+    return distances
+
+
+def simplify(points, tolerance):
+    """Removes points that lie within `tolerance` of the path without them.
+
+    Uses the Ramer-Douglas-Peucker algorithm, after rounding the points to
+    whole steps and dropping repeats. Straight runs become a single move.
+    """
+    points = dedupe(points)
+    if len(points) < 3:
+        return points
+    xs, ys = zip(*points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        distances = _chord_distances(xs, ys, first, last)
+        worst = max(range(len(distances)), key=distances.__getitem__)
+        if distances[worst] > tolerance:
+            middle = first + 1 + worst
+            keep[middle] = True
+            stack.append((first, middle))
+            stack.append((middle, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+# Most points iter_simplify holds back before it has to keep one.
+SIMPLIFY_WINDOW = 32
+
+
+def _strays(anchor, run, point, tolerance):
+    """Returns True if any point in run is more than `tolerance` from the
+    segment from anchor to point."""
+    ax, ay = anchor
+    dx, dy = point[0] - ax, point[1] - ay
+    length = float(dx * dx + dy * dy)
+    for px, py in run:
+        px, py = px - ax, py - ay
+        u = min(max((px * dx + py * dy) / length, 0), 1) if length else 0
+        if math.hypot(px - u * dx, py - u * dy) > tolerance:
+            return True
+    return False
+
+
+def iter_simplify(points, tolerance, window=SIMPLIFY_WINDOW):
+    """Like simplify, but one point at a time.
+
+    Rounds points to whole steps and drops repeats, then drops each point
+    that the line from the last point kept to the one after it passes
+    within `tolerance` of, along with the ones dropped before it. At most
+    `window` points are held back at once, so a long straight run is
+    sent as several moves, but memory use stays the same however long the
+    path is.
+    """
+    anchor = None
+    run = []
+    for x, y in points:
+        point = (int(round(x)), int(round(y)))
+        if anchor is None:
+            anchor = point
+            yield point
+            continue
+        if point == (run[-1] if run else anchor):
+            continue
+        if run and (len(run) >= window or _strays(anchor, run, point, tolerance)):
+            anchor = run[-1]
+            yield anchor
+            run = []
+        run.append(point)
+    if run:
+        yield run[-1]
+
+
+# Within this radius of the centre the rotor's angle barely matters. Matches
+# CENTER_THRESHOLD in the firmware.
+CENTER_THRESHOLD = 100
+# Most times a segment is halved to follow it in polar moves.
+MAX_SPLIT_DEPTH = 12
+
+
+def to_polar(x, y, steps_per_circle):
+    """Returns the radius and rotor position of a point, in steps.
+
+    Uses the firmware's convention, where the rotor is at 0 for points on
+    the negative x axis.
+    """
+    theta = (math.atan2(y, x) + math.pi) * steps_per_circle / (2 * math.pi)
+    return math.hypot(x, y), theta
+
+
+def from_polar(radius, theta, steps_per_circle):
+    angle = theta * 2 * math.pi / steps_per_circle - math.pi
+    return radius * math.cos(angle), radius * math.sin(angle)
+
+
+def _unwrap(theta, previous, steps_per_circle):
+    """Returns the angle equal to theta, modulo a turn, that is nearest previous."""
+    half = steps_per_circle / 2.0
+    return previous + (theta - previous + half) % steps_per_circle - half
+
+
+def _split(a, b, steps_per_circle, tolerance, depth=0):
+    """Returns the points after a needed to follow the line from a to b
+    within `tolerance` when moving linearly in radius and angle."""
+    ra, ta = to_polar(a[0], a[1], steps_per_circle)
+    rb, tb = to_polar(b[0], b[1], steps_per_circle)
+    if depth >= MAX_SPLIT_DEPTH or max(ra, rb) < CENTER_THRESHOLD:
+        return [b]
+    tb = _unwrap(tb, ta, steps_per_circle)
+    mx, my = from_polar((ra + rb) / 2, (ta + tb) / 2, steps_per_circle)
+    middle = ((a[0] + b[0]) / 2.0, (a[1] + b[1]) / 2.0)
+    if math.hypot(mx - middle[0], my - middle[1]) <= tolerance:
+        return [b]
+    return (_split(a, middle, steps_per_circle, tolerance, depth + 1) +
+            _split(middle, b, steps_per_circle, tolerance, depth + 1))
+
+
+def plan_polar(points, steps_per_circle, tolerance, start_theta=0):
+    """Converts a path to a list of (radius, theta) positions in whole steps.
+
+    Segments are split wherever moving linearly in radius and angle would
+    stray more than `tolerance` from the straight line. Theta is unwrapped:
+    it runs on past a full turn instead of going back to 0, so the rotor
+    always takes the short way round, starting from `start_theta`. Near the
+    centre, where the angle means little, the path keeps its angle until
+    the point closest to the centre and turns on the spot there.
+    """
+    return list(iter_polar(points, steps_per_circle, tolerance, start_theta))
+
+
+def _iter_dense(points, steps_per_circle, tolerance):
+    """Yields points with those _split adds between them."""
+    previous = None
+    for point in points:
+        if previous is None:
+            yield point
+        else:
+            for split in _split(previous, point, steps_per_circle, tolerance):
+                yield split
+        previous = point
+
+
+def _iter_positions(points, steps_per_circle, tolerance, start_theta):
+    """Yields the (radius, theta) positions for plan_polar, before rounding."""
+    previous = start_theta
+    # Radii of the points since the path last came within CENTER_THRESHOLD.
+    inner = []
+    for x, y in _iter_dense(points, steps_per_circle, tolerance):
+        radius, theta = to_polar(x, y, steps_per_circle)
+        if radius < CENTER_THRESHOLD:
+            inner.append(radius)
+            continue
+        if inner:
+            turn = min(range(len(inner)), key=inner.__getitem__)
+            for k, inner_radius in enumerate(inner):
+                yield inner_radius, previous
+                if k == turn:
+                    previous = _unwrap(theta, previous, steps_per_circle)
+                    yield inner_radius, previous
+            inner = []
+        previous = _unwrap(theta, previous, steps_per_circle)
+        yield radius, previous
+    for inner_radius in inner:
+        yield inner_radius, previous
+
+
+def iter_polar(points, steps_per_circle, tolerance, start_theta=0):
+    """Like plan_polar, but yields the positions one at a time.
+
+    Only a stretch of the path near the centre is held back, until the
+    path leaves it and the angle to turn to is known.
+    """
+    last = None
+    for radius, theta in _iter_positions(points, steps_per_circle, tolerance, start_theta):
+        position = (int(round(radius)), int(round(theta)))
+        if position != last:
+            yield position
+            last = position
@@ -1,5 +1,22 @@
+import collections
+import itertools
 import logging
 import math
+import Queue
+import struct
+import threading
+
+# Size of the Arduino's serial receive buffer. One byte of it is always left
+# empty, so at most one less than this can be waiting to be read.
+SERIAL_BUFFER_SIZE = 64
+
+# Most points the firmware accepts in one batch command. A batch is the
+# command and a space, a count byte and a little-endian int16 x and y for
+# each point, which has to fit in the serial buffer.
+MAX_BATCH = 15
+
+# Within this radius the firmware leaves the rotor where it is.
+CENTER_THRESHOLD = 100
 
 class Error(Exception): pass
 
@@ -12,9 +29,23 @@ class UnexpectedResponseError(Error):
 
 
 class SandPlotter(object):
-    def __init__(self, socket, debug=False):
+    """Talks to the plotter firmware over a serial connection.
+
+    Commands are streamed: each is sent as soon as there is room for it in
+    the firmware's receive buffer, and the OKs are matched up with them as
+    they come back. The firmware acknowledges a command as soon as it has
+    read it, so the acknowledged commands are never still in its buffer.
+    Commands that need an answer wait for everything sent before them.
+    """
+
+    def __init__(self, socket, debug=False, window=SERIAL_BUFFER_SIZE - 1, on_log=None):
         self._socket = socket
         self._debug = debug
+        # Called with each LOG line the firmware sends.
+        self._on_log = on_log or logging.debug
+        self._window = window
+        self._in_flight = collections.deque()
+        self._in_flight_bytes = 0
         self._get_info()
 
     def _write(self, data):
@@ -27,7 +58,7 @@ class SandPlotter(object):
             result = self._socket.readline()
             if not result.startswith("LOG "):
                 break
-            logging.debug(result)
+            self._on_log(result[4:].rstrip())
         if self._debug:
             logging.debug("< %r", result)
         return result
@@ -36,8 +67,23 @@ class SandPlotter(object):
         result = self._readline().strip()
         if result != "OK":
             raise UnexpectedResponseError(result)
+        self._in_flight_bytes -= self._in_flight.popleft()
+
+    def _send(self, data):
+        """Writes a command once there is room in the window for it."""
+        while self._in_flight and self._in_flight_bytes + len(data) > self._window:
+            self._read_ok()
+        self._write(data)
+        self._in_flight.append(len(data))
+        self._in_flight_bytes += len(data)
+
+    def flush(self):
+        """Waits until every command sent has been acknowledged."""
+        while self._in_flight:
+            self._read_ok()
 
     def _get_info(self):
+        self.flush()
         self._write("? \n");
         result = self._readline().strip()
         result_parts = result.split(" ")
@@ -46,6 +92,8 @@ class SandPlotter(object):
         status, theta_steps, max_r, theta, r = result_parts[:5]
         if status != 'INFO':
             raise UnexpectedResponseError(result)
+        # Anything after the position lists optional commands the firmware has.
+        self.capabilities = set(result_parts[5:])
         self.steps_per_circle = int(theta_steps)
         self.steps_per_radian = self.steps_per_circle / (math.pi * 2)
         self.max_radius = int(max_r)
@@ -56,31 +104,173 @@ class SandPlotter(object):
     def theta(self):
         return self._theta / self.steps_per_radian
 
-    def move_xy(self, x, y):
-        self._write("m %d %d\n" % (x, y))
-        self._read_ok()
+    def _moved_to(self, x, y):
+        """Tracks where the firmware will put the ball after moving to x, y."""
         self.radius = int(math.sqrt(x * x + y * y))
-        self._theta = math.atan2(y, x)
+        if self.radius >= CENTER_THRESHOLD:
+            self._theta = int((math.atan2(y, x) + math.pi) * self.steps_per_radian)
+
+    def move_xy(self, x, y):
+        self._send("m %d %d\n" % (x, y))
+        self._moved_to(x, y)
+
+    def move_batch(self, points):
+        """Moves through up to MAX_BATCH points with a single command.
+
+        Falls back to separate moves if the firmware doesn't support batches.
+        """
+        if not points:
+            return
+        if 'b' not in self.capabilities:
+            for point in points:
+                self.move_xy(*point)
+            return
+        frame = "".join(struct.pack("<hh", int(x), int(y)) for x, y in points)
+        self._send("b " + chr(len(points)) + frame)
+        self._moved_to(*points[-1])
+
+    def _move_through(self, points):
+        points = iter(points)
+        while True:
+            batch = list(itertools.islice(points, MAX_BATCH))
+            if not batch:
+                break
+            self.move_batch(batch)
 
     def move_polar(self, radius, theta):
-        step_theta = int(theta * self.steps_per_radian)
-        self._write("p %d %d\n" % (radius, step_theta))
-        self._read_ok()
-        self.radius += radius
-        self._theta = (self._theta + step_theta) % self.steps_per_circle
+        self.move_steps(radius, int(theta * self.steps_per_radian))
+
+    def move_steps(self, dr, dtheta):
+        """Moves by dr radial and dtheta rotary steps, both motors together.
+
+        Uses the firmware's integer-only r command if it has one. Returns
+        False, and doesn't move, if the move is a turn on the spot within
+        CENTER_THRESHOLD of the centre and the firmware only has the p
+        command, which can't turn at the centre: it divides by dr there.
+        Such turns barely move the ball, and the caller can add them to
+        its next move instead.
+        """
+        if 'r' in self.capabilities:
+            command = 'r'
+        elif dr == 0 and self.radius < CENTER_THRESHOLD:
+            return False
+        else:
+            command = 'p'
+        self._send("%s %d %d\n" % (command, dr, dtheta))
+        self.radius += dr
+        self._theta = (self._theta + dtheta) % self.steps_per_circle
+        return True
+
+    @property
+    def theta_steps(self):
+        return self._theta
+
+    def plot_polar(self, positions):
+        """Moves through (radius, theta) positions in steps, as made by
+        `paths.plan_polar`. Theta can run past a full turn."""
+        theta = self._theta
+        for radius, target in positions:
+            if radius != self.radius or target != theta:
+                if not self.move_steps(radius - self.radius, target - theta):
+                    # Turn as part of the next move.
+                    continue
+            theta = target
+        self.flush()
 
     def plot(self, points):
-        for point in points:
-            self.move_xy(*point)
+        """Moves through points, which can be any iterable, including a
+        generator that is still working out the later points."""
+        self._move_through(points)
+        self.flush()
+
+    def plot_segments(self, segments):
+        """Plots a list of continuous paths, travelling between them."""
+        for segment in segments:
+            if not segment:
+                continue
+            self.travel(*segment[0])
+            self._move_through(segment[1:])
+        self.flush()
+
+    def travel(self, x, y):
+        """Moves to the start of a new path. The ball can't be lifted, so this
+        is just a straight move."""
+        self.move_xy(x, y)
 
     def set_speed(self, speed):
-        self._write("s %d\n" % (speed,))
-        self._read_ok()
+        self._send("s %d\n" % (speed,))
+        self.flush()
 
     def zero(self):
-        self._write("0 \n")
-        self._read_ok()
+        self._send("0 \n")
+        self.flush()
 
     def noop(self):
-        self._write("n \n")
-        self._read_ok()
+        self._send("n \n")
+        self.flush()
+
+
+class BackgroundPlotter(object):
+    """Runs a SandPlotter's commands in a thread of its own.
+
+    Has the same methods as SandPlotter, but they queue the command and
+    return at once, so the caller can work out what to draw next while
+    the table is still drawing. `wait` blocks until everything queued has
+    been sent, and raises any error the plotter ran into. LOG lines from
+    the firmware are put on the `logs` queue. The table's size and the
+    plotter's position can be read as on a SandPlotter; reading the
+    position waits for the queued moves first.
+    """
+
+    def __init__(self, socket, **kwargs):
+        self.logs = Queue.Queue()
+        self.plotter = SandPlotter(socket, on_log=self.logs.put, **kwargs)
+        self._jobs = Queue.Queue()
+        self._error = None
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        while True:
+            func, args = self._jobs.get()
+            try:
+                if self._error is None:
+                    func(*args)
+            except Exception, e:
+                logging.exception("Plotter command failed")
+                self._error = e
+            finally:
+                self._jobs.task_done()
+
+    def run(self, func, *args):
+        """Queues a call to func(plotter, *args) in the plotter's thread."""
+        self._jobs.put((func, (self.plotter,) + args))
+
+    def wait(self):
+        """Waits until every queued command has been sent."""
+        self._jobs.join()
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    @property
+    def steps_per_circle(self):
+        return self.plotter.steps_per_circle
+
+    @property
+    def max_radius(self):
+        return self.plotter.max_radius
+
+    @property
+    def theta_steps(self):
+        self.wait()
+        return self.plotter.theta_steps
+
+    def __getattr__(self, name):
+        method = getattr(SandPlotter, name)
+        if not callable(method) or name.startswith('_'):
+            raise AttributeError(name)
+        def queue(*args):
+            self.run(method, *args)
+        return queue
@@ -0,0 +1,248 @@
+#! /usr/bin/env python
+"""A stand-in for the plotter, for testing the host code without a table.
+
+`SimulatedSerial` can be passed to `SandPlotter` instead of a
+`serial.Serial`. It speaks the same protocol as sandplotter.ino and keeps
+a virtual clock instead of sleeping:
+- bytes take ten bit times each way at the given baud rate, and arrive
+  one at a time;
+- the firmware reads a command's letter once it has arrived and the
+  previous move has finished, and the rest as it arrives, acknowledges
+  the command, then spends as long on the move as `estimate.MotionModel`
+  says;
+- the 64 byte receive buffer overflows if the host sends more than the
+  firmware has room for, which is counted, or raised with `strict`.
+The path the ball takes is recorded and can be saved as an image.
+"""
+
+import collections
+import struct
+import sys
+
+import estimate
+import paths
+import sandplotter
+
+# Bytes each way are a start bit, eight data bits and a stop bit.
+BITS_PER_BYTE = 10
+# Points used to draw each polar move into the ball path.
+POLAR_MOVE_POINTS = 16
+# The letters of the commands every version of the firmware knows. The
+# others are listed in its capabilities.
+BASIC_COMMANDS = "mps0n?"
+
+
+class BufferOverflowError(sandplotter.Error):
+    def __str__(self):
+        return "Serial receive buffer overflowed"
+
+
+class SimulatedSerial(object):
+    def __init__(self, baud=38400, steps_per_circle=estimate.STEPS_PER_CIRCLE,
+                 max_radius=estimate.MAX_RADIUS, capabilities=('b', 'r'),
+                 log=False, strict=False, wait_for_separator=True):
+        self.baud = baud
+        self.steps_per_circle = steps_per_circle
+        self.max_radius = max_radius
+        self.capabilities = capabilities
+        self.log = log
+        self.strict = strict
+        # Older firmware discarded the space after a command's letter
+        # without waiting for it to arrive. A space that hadn't arrived
+        # yet was left to be read as the first byte of the arguments,
+        # which breaks the binary `b` command.
+        self.wait_for_separator = wait_for_separator
+        self.model = estimate.MotionModel(1000, steps_per_circle)
+        self.path = [(0, 0)]
+        # The host's time, and when the line to the firmware is next free.
+        self.clock = 0.0
+        self._line_free = 0.0
+        # When the firmware finishes its current move.
+        self._busy_until = 0.0
+        # (byte, arrival time) of the bytes the firmware hasn't read yet.
+        self._received = []
+        # (read time, size) of commands that are still in the buffer.
+        self._unread = collections.deque()
+        self._responses = collections.deque()
+        self.bytes_written = 0
+        self.commands = 0
+        self.overflows = 0
+
+    def _byte_time(self, count):
+        return count * BITS_PER_BYTE / float(self.baud)
+
+    @property
+    def elapsed(self):
+        """The time at which everything sent so far will have been done."""
+        return max(self.clock, self._busy_until)
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        start = max(self.clock, self._line_free)
+        for i, byte in enumerate(data):
+            self._received.append((byte, start + self._byte_time(i + 1)))
+        self._line_free = start + self._byte_time(len(data))
+        while True:
+            command = self._next_command()
+            if command is None:
+                break
+            self._receive(*command)
+
+    def _next_command(self):
+        """Takes the next complete command off the received bytes, as the
+        firmware would read them.
+
+        Returns the command's letter, its arguments, the time its last byte
+        arrived and the number of bytes it took, or None if the rest of it
+        hasn't been written yet.
+        """
+        received = self._received
+        # The firmware skips bytes that don't start a command it knows.
+        while received and received[0][0] not in BASIC_COMMANDS + "".join(self.capabilities):
+            del received[0]
+        if len(received) < 2:
+            return None
+        name, arrival = received[0]
+        start = 2
+        if not self.wait_for_separator and received[1][1] > max(arrival, self._busy_until):
+            start = 1
+        if name == 'b':
+            if len(received) <= start:
+                return None
+            count = ord(received[start][0])
+            # The firmware reads no further than the count of a batch that's too long.
+            size = start + 1 + (4 * count if count <= sandplotter.MAX_BATCH else 0)
+        else:
+            ends = [i for i in range(start, len(received)) if received[i][0] == '\n']
+            if not ends:
+                return None
+            size = ends[0] + 1
+        if len(received) < size:
+            return None
+        args = "".join(byte for byte, when in received[start:size])
+        arrival = received[size - 1][1]
+        del received[:size]
+        return name, args, arrival, size
+
+    def _receive(self, name, args, arrival, size):
+        while self._unread and self._unread[0][0] <= arrival:
+            self._unread.popleft()
+        read_time = max(arrival, self._busy_until)
+        self._unread.append((read_time, size))
+        if sum(size for when, size in self._unread) > sandplotter.SERIAL_BUFFER_SIZE - 1:
+            self.overflows += 1
+            if self.strict:
+                raise BufferOverflowError()
+        self.commands += 1
+        reply, duration = self._execute(name, args)
+        self._busy_until = read_time + duration
+        for line in reply:
+            read_time += self._byte_time(len(line) + 2)
+            self._responses.append((read_time, line))
+
+    def _execute(self, name, args):
+        """Carries out a command, returning its replies and how long it takes."""
+        model = self.model
+        if name == '?':
+            info = "INFO %d %d %d %d" % (self.steps_per_circle, self.max_radius, model.theta, model.r)
+            return [" ".join((info,) + tuple(self.capabilities))], 0
+        if name == 'b' and 'b' in self.capabilities:
+            count = ord(args[0])
+            if count > sandplotter.MAX_BATCH:
+                return ["ERROR batch too long"], 0
+            coords = struct.unpack("<%dh" % (count * 2), args[1:])
+            duration = 0
+            for x, y in zip(coords[::2], coords[1::2]):
+                duration += model.move_xy(x, y)
+                self.path.append((x, y))
+            return ["OK"] + self._log(), duration
+        if name == 'm':
+            x, y = [int(v) for v in args.split()]
+            duration = model.move_xy(x, y)
+            self.path.append((x, y))
+            return ["OK"] + self._log(), duration
+        if name == 'p' or (name == 'r' and 'r' in self.capabilities):
+            dr, dtheta = [int(v) for v in args.split()]
+            if name == 'p' and dr == 0 and model.r == 0:
+                # do_move_polar divides by dr at the centre, and ends
+                # without turning.
+                return ["OK"] + self._log(), 0
+            r, theta = model.r, model.theta
+            duration = model.move_steps(dr, dtheta)
+            for i in range(1, POLAR_MOVE_POINTS + 1):
+                f = i / float(POLAR_MOVE_POINTS)
+                self.path.append(paths.from_polar(r + dr * f, theta + dtheta * f, self.steps_per_circle))
+            return ["OK"] + self._log(), duration
+        if name == 's':
+            model.interval = int(args)
+            return ["OK"], 0
+        if name == '0':
+            # The arm runs in to its limit while the rotor turns forwards to its.
+            ticks = max(model.r, (self.steps_per_circle - model.theta) % self.steps_per_circle)
+            model.x = model.y = model.r = model.theta = 0
+            self.path.append((0, 0))
+            return ["OK"], ticks * model.interval / 1e6
+        if name == 'n':
+            return ["OK"], 0
+        # The firmware ignores commands it doesn't know.
+        return [], 0
+
+    def _log(self):
+        if not self.log:
+            return []
+        return ["LOG Final x = %d, y = %d" % (self.model.x, self.model.y)]
+
+    def readline(self):
+        if not self._responses:
+            raise IOError("Read would block forever: no reply is coming")
+        when, line = self._responses.popleft()
+        self.clock = max(self.clock, when)
+        return line + "\r\n"
+
+    def close(self):
+        pass
+
+    def save_image(self, filename, size=800, penwidth=2):
+        """Draws the path the ball has taken."""
+        try:
+            from PIL import Image, ImageDraw
+        except ImportError:
+            import Image, ImageDraw
+        im = Image.new("RGB", (size, size), (230, 210, 170))
+        draw = ImageDraw.Draw(im)
+        scale = size / (2.0 * self.max_radius)
+        points = [((x + self.max_radius) * scale, (self.max_radius - y) * scale) for x, y in self.path]
+        for src, dest in zip(points, points[1:]):
+            draw.line((src, dest), fill=(90, 70, 40), width=penwidth)
+        im.save(filename)
+
+
+def main(args):
+    import curveplotter
+    import piclang
+    formula = args[0]
+    points = int(args[1]) if len(args) > 1 else 1000
+    image = args[2] if len(args) > 2 else None
+    curve = eval(formula, vars(piclang))
+    segments = curveplotter.curve_segments(curve, points)
+    print "%-12s %10s %10s %10s %10s" % ("mode", "minutes", "bytes", "commands", "overflows")
+    for mode, capabilities in (("m", ()), ("b", ('b',)), ("r", ('b', 'r'))):
+        device = SimulatedSerial(capabilities=capabilities)
+        plotter = sandplotter.SandPlotter(device)
+        plotter.set_speed(2000)
+        if 'r' in capabilities:
+            tolerance = paths.plotter_tolerance(plotter.steps_per_circle, plotter.max_radius)
+            for segment in segments:
+                plotter.travel(*segment[0])
+                plotter.plot_polar(paths.plan_polar(
+                    segment, plotter.steps_per_circle, tolerance, plotter.theta_steps))
+        else:
+            plotter.plot_segments(segments)
+        print "%-12s %10.1f %10d %10d %10d" % (
+            mode, device.elapsed / 60, device.bytes_written, device.commands, device.overflows)
+    if image:
+        device.save_image(image)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
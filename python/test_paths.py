@@ -0,0 +1,22 @@
+import unittest
+
+import paths
+
+
+class SimplifyTest(unittest.TestCase):
+    def test_straight_line(self):
+        self.assertEqual(paths.simplify([(0, 0), (1, 1), (2, 2), (3, 3)], 1.0), [(0, 0), (3, 3)])
+
+    def test_keeps_reversals(self):
+        # Doubling back along the same line, as boustro and reverse do.
+        points = [(0, 0), (100, 0), (200, 0), (300, 0), (200, 0), (100, 0), (50, 0)]
+        self.assertEqual(paths.simplify(points, 1.0), [(0, 0), (300, 0), (50, 0)])
+        self.assertEqual(list(paths.iter_simplify(points, 1.0)), [(0, 0), (300, 0), (50, 0)])
+
+    def test_keeps_corners(self):
+        points = [(0, 0), (50, 0), (100, 0), (100, 50), (100, 100)]
+        self.assertEqual(paths.simplify(points, 1.0), [(0, 0), (100, 0), (100, 100)])
+
+
+if __name__ == '__main__':
+    unittest.main()
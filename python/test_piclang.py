@@ -0,0 +1,54 @@
+import unittest
+
+import piclang
+from piclang import circle
+
+
+class AdaptiveSamplingTest(unittest.TestCase):
+    def assertFullCircle(self, xs, ys):
+        self.assertAlmostEqual(xs.ptp(), 2, places=3)
+        self.assertAlmostEqual(ys.ptp(), 2, places=3)
+
+    def test_repeats_that_are_multiples_of_the_grid(self):
+        for times in (piclang.ADAPTIVE_MIN_POINTS, 2 * piclang.ADAPTIVE_MIN_POINTS,
+                      4 * piclang.ADAPTIVE_MIN_POINTS):
+            self.assertFullCircle(*piclang.adaptive_interpolate_array(circle ** times, 0.01))
+
+    def test_segments_of_repeats_that_are_multiples_of_the_grid(self):
+        segments = piclang.interpolate_segments(circle ** 202, 8192, 0.5, (400, 400))
+        self.assertFullCircle(piclang.numpy.concatenate([xs for xs, ys in segments]),
+                              piclang.numpy.concatenate([ys for xs, ys in segments]))
+
+    def test_ends_where_even_sampling_does(self):
+        f = circle * piclang.line
+        xs, ys = piclang.adaptive_interpolate_array(f, 0.01, max_points=8192)
+        self.assertEqual((xs[-1], ys[-1]), f(8191 / 8192.0))
+        xs, ys = piclang.interpolate_segments(f, 8192, 0.5)[-1]
+        self.assertEqual((xs[-1], ys[-1]), f(8191 / 8192.0))
+
+    def test_sample_grid(self):
+        ts = piclang.sample_grid(100)
+        self.assertEqual(ts[0], 0)
+        self.assertTrue((piclang.numpy.diff(ts) > 0).all())
+        self.assertTrue((ts < 1).all())
+        self.assertTrue((piclang.sample_grid(100, 10, 20) == ts[10:20]).all())
+
+
+class DiscontinuitiesTest(unittest.TestCase):
+    def test_nested_repeats_are_capped(self):
+        for curve in ((circle // 3000) ** 3000, ((circle ** 100) ** 100) ** 100):
+            self.assertEqual(curve.discontinuities(), [])
+
+    def test_small_repeats(self):
+        self.assertEqual(len(((circle // 3) ** 2).discontinuities()), 5)
+
+
+class RenderTest(unittest.TestCase):
+    def test_plain_function(self):
+        for tolerance in (None, 0.5):
+            image = piclang.render(lambda t: (t, t * t), 200, 100, tolerance=tolerance)
+            self.assertEqual(image.size, (100, 100))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import unittest
+
+import paths
+import sandplotter
+import simulator
+
+
+class RecordingSerial(simulator.SimulatedSerial):
+    """A simulated plotter that checks the host's window as it goes.
+
+    Records each command the firmware runs, the most bytes ever sent but
+    not yet acknowledged, and how many OKs the host has read.
+    """
+
+    def __init__(self, **kwargs):
+        super(RecordingSerial, self).__init__(**kwargs)
+        self.sent = []
+        self.executed = []
+        self.acknowledged = 0
+        self.max_unacknowledged = 0
+
+    def write(self, data):
+        self.sent.append(data)
+        super(RecordingSerial, self).write(data)
+        unacknowledged = sum(len(command) for command in self.sent[self.acknowledged:])
+        self.max_unacknowledged = max(self.max_unacknowledged, unacknowledged)
+
+    def _execute(self, name, args):
+        self.executed.append(name)
+        return super(RecordingSerial, self)._execute(name, args)
+
+    def readline(self):
+        line = super(RecordingSerial, self).readline()
+        if line.strip() == "OK" or line.startswith("INFO"):
+            self.acknowledged += 1
+        return line
+
+
+def square(size, count):
+    side = count // 4
+    points = []
+    for i in range(side):
+        offset = size * i // side
+        points.extend([(offset, 0), (size, offset), (size - offset, size), (0, size - offset)])
+    return points
+
+
+class WindowTest(unittest.TestCase):
+    def plot(self, capabilities, baud=38400):
+        device = RecordingSerial(capabilities=capabilities, baud=baud, strict=True)
+        plotter = sandplotter.SandPlotter(device)
+        plotter.set_speed(500)
+        plotter.plot(square(2000, 400))
+        plotter.plot_polar([(100 * k, 50 * k) for k in range(1, 40)])
+        plotter.zero()
+        return device, plotter
+
+    def check(self, device, plotter):
+        self.assertLessEqual(device.max_unacknowledged, sandplotter.SERIAL_BUFFER_SIZE - 1)
+        self.assertEqual(device.overflows, 0)
+        # Every command was run, in the order it was sent, and acknowledged.
+        self.assertEqual(device.executed, [command[0] for command in device.sent])
+        self.assertEqual(device.acknowledged, len(device.sent))
+        self.assertFalse(plotter._in_flight)
+
+    def test_text_commands(self):
+        self.check(*self.plot(()))
+
+    def test_batches(self):
+        self.check(*self.plot(('b', 'r')))
+
+    def test_slow_line(self):
+        self.check(*self.plot(('b', 'r'), baud=2400))
+
+    def test_path_is_followed(self):
+        device, plotter = self.plot(('b',))
+        points = square(2000, 400)
+        self.assertEqual(device.path[1:len(points) + 1], points)
+
+
+class SeparatorTest(unittest.TestCase):
+    """The space after a command's letter arrives a byte time after the
+    letter, so an idle firmware reads the letter before it's there."""
+
+    def batch(self, wait_for_separator):
+        device = simulator.SimulatedSerial(capabilities=('b',), wait_for_separator=wait_for_separator)
+        plotter = sandplotter.SandPlotter(device)
+        plotter.move_batch([(10, 20), (30, 40)])
+        plotter.flush()
+        return device
+
+    def test_batch_to_idle_firmware(self):
+        device = self.batch(True)
+        self.assertEqual(device.path, [(0, 0), (10, 20), (30, 40)])
+
+    def test_firmware_that_does_not_wait(self):
+        self.assertRaises(sandplotter.UnexpectedResponseError, self.batch, False)
+
+
+class CentreTurnTest(unittest.TestCase):
+    def test_turn_at_centre_without_r(self):
+        # The p command can't turn on the spot at the centre, so the turn
+        # plan_polar makes there has to go with the move out.
+        device = simulator.SimulatedSerial(capabilities=('b',))
+        plotter = sandplotter.SandPlotter(device)
+        plotter.move_steps(1000, 0)
+        positions = paths.plan_polar([(-1000, 0), (-1, 0), (0, 0), (0, 1000)],
+                                     plotter.steps_per_circle, 1, plotter.theta_steps)
+        plotter.plot_polar(positions)
+        radius, theta = positions[-1]
+        self.assertEqual(plotter.theta_steps, theta % plotter.steps_per_circle)
+        self.assertEqual(device.model.theta, theta % plotter.steps_per_circle)
+        self.assertAlmostEqual(device.model.x, 0, delta=2)
+        self.assertAlmostEqual(device.model.y, 1000, delta=2)
+
+
+class BackgroundPlotterTest(unittest.TestCase):
+    def test_reads_wait_for_queued_moves(self):
+        device = simulator.SimulatedSerial()
+        plotter = sandplotter.BackgroundPlotter(device)
+        self.assertEqual(plotter.steps_per_circle, device.steps_per_circle)
+        self.assertEqual(plotter.max_radius, device.max_radius)
+        plotter.move_steps(1000, 300)
+        self.assertEqual(plotter.theta_steps, 300)
+        self.assertEqual(device.model.theta, 300)
+
+
+if __name__ == '__main__':
+    unittest.main()
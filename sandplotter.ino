@@ -22,6 +22,10 @@
 
 #define CENTER_THRESHOLD 100
 
+// Most points in a batch command; the whole command has to fit in the 63
+// bytes of the serial buffer.
+#define MAX_BATCH 15
+
 #define RADS_TO_STEPS (STEPS_PER_CIRCLE / (2.0 * M_PI))
 
 // All values in steps
@@ -45,6 +49,15 @@ void read_line(char *buf) {
   }
 }
 
+void read_bytes(char *buf, int len) {
+  while(len > 0) {
+    if(Serial.available() > 0) {
+      *buf++ = (char)Serial.read();
+      len--;
+    }
+  }
+}
+
 void discard_line() {
   // Ignore everything until newline
   for(;;) {
@@ -297,6 +310,45 @@ void do_move_polar(long dr, long dtheta, int interval) {
 #endif
 }
 
+// Moves by dr and dtheta steps in a straight line in polar space, with the
+// motors stepped Bresenham-style from integer error terms.
+void do_move_steps(long dr, long dtheta, int interval) {
+  long r_steps = abs(dr), theta_steps = abs(dtheta);
+  long distance = MAX(r_steps, theta_steps);
+  long r_error = distance / 2, theta_error = distance / 2;
+
+  digitalWrite(LINEAR_DIR, dr > 0);
+  digitalWrite(ROTARY_DIR, dtheta > 0);
+  enable_steppers(interval);
+
+  for(long i = 0; i < distance; i++) {
+    while(phase != PHASE_UP_EDGE);
+
+    r_error -= r_steps;
+    if(r_error < 0) {
+      r_error += distance;
+      digitalWrite(LINEAR_STEP, HIGH);
+      cur_r += sign(dr);
+    }
+    theta_error -= theta_steps;
+    if(theta_error < 0) {
+      theta_error += distance;
+      digitalWrite(ROTARY_STEP, HIGH);
+      cur_theta += sign(dtheta);
+      if(cur_theta < 0)
+        cur_theta += STEPS_PER_CIRCLE;
+      else if(cur_theta >= STEPS_PER_CIRCLE)
+        cur_theta -= STEPS_PER_CIRCLE;
+    }
+
+    phase = PHASE_IDLE;
+  }
+
+  disable_steppers();
+  cur_x = cos(cur_theta / RADS_TO_STEPS - M_PI) * cur_r;
+  cur_y = sin(cur_theta / RADS_TO_STEPS - M_PI) * cur_r;
+}
+
 void do_zero(int interval) {
   int linear_limit = LOW;
   int rotary_limit = LOW;
@@ -334,6 +386,10 @@ void do_zero(int interval) {
   cur_x = cur_y = cur_r = cur_theta = 0;
 }
 
+// Commands print OK as soon as they have read their line, before doing any
+// work. The host streams further commands into the serial buffer meanwhile,
+// keeping no more unacknowledged bytes in flight than the buffer can hold.
+
 void move_xy() {
   char buf[64];
   int x, y;
@@ -343,6 +399,22 @@ void move_xy() {
   do_move_xy(x, y, interval);
 }
 
+// Binary: a count byte, then a little-endian int16 x and y for each point.
+void move_batch() {
+  uint8_t count;
+  int16_t points[MAX_BATCH][2];
+  read_bytes((char *)&count, 1);
+  if(count > MAX_BATCH) {
+    Serial.println("ERROR batch too long");
+    return;
+  }
+  read_bytes((char *)points, count * sizeof(points[0]));
+  Serial.println("OK");
+  for(int i = 0; i < count; i++) {
+    do_move_xy(points[i][0], points[i][1], interval);
+  }
+}
+
 void move_polar() {
   char buf[64];
   long r, theta;
@@ -352,6 +424,15 @@ void move_polar() {
   do_move_polar(r, theta, interval);
 }
 
+void move_steps() {
+  char buf[64];
+  long dr, dtheta;
+  read_line(buf);
+  sscanf(buf, "%ld %ld", &dr, &dtheta);
+  Serial.println("OK");
+  do_move_steps(dr, dtheta, interval);
+}
+
 void speed() {
   char buf[8];
   read_line(buf);
@@ -382,7 +463,9 @@ void info() {
   Serial.print(" ");
   Serial.print(cur_theta);
   Serial.print(" ");
-  Serial.println(cur_r);
+  Serial.print(cur_r);
+  // Optional commands, for the host to check before using them.
+  Serial.println(" b r");
 }
 
 struct command_t {
@@ -390,7 +473,9 @@ struct command_t {
   void (*func)();
 } commands[] = {
   {'m', move_xy},
+  {'b', move_batch},
   {'p', move_polar},
+  {'r', move_steps},
   {'s', speed},
   {'0', zero},
   {'n', noop},
@@ -405,7 +490,11 @@ void loop() {
     cmd = (char)Serial.read();
     for(struct command_t *def = commands; def->func != NULL; def++) {
       if(def->name == cmd) {
-        Serial.read(); // Discard space
+        // Discard the space, waiting for it first: if it hasn't arrived,
+        // read() takes nothing and a binary command would read the space
+        // as its first byte.
+        while(!Serial.available());
+        Serial.read();
         def->func();
         break;
       }